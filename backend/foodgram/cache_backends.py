@@ -0,0 +1,61 @@
+from django.core.cache.backends.locmem import LocMemCache
+
+_states = {}
+
+
+class _SizeState:
+    def __init__(self):
+        self.sizes = {}
+        self.total = 0
+
+
+class SizeLimitedLocMemCache(LocMemCache):
+    """
+    LocMemCache с ограничением суммарного размера значений
+    (OPTIONS['MAX_BYTES']): при переполнении вытесняются записи, которые
+    дольше всех не читали; значение больше лимита не сохраняется
+    """
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        options = params.get('OPTIONS', {})
+        self._max_bytes = int(options.get('MAX_BYTES', 64 * 1024 * 1024))
+        self._state = _states.setdefault(name, _SizeState())
+
+    def _set(self, key, value, timeout=None):
+        self._delete(key)
+        if len(value) > self._max_bytes:
+            return
+        super()._set(key, value, timeout)
+        self._state.sizes[key] = len(value)
+        self._state.total += len(value)
+        while self._state.total > self._max_bytes:
+            self._evict()
+
+    def _evict(self):
+        key, _ = self._cache.popitem()
+        self._expire_info.pop(key, None)
+        self._forget(key)
+
+    def _forget(self, key):
+        self._state.total -= self._state.sizes.pop(key, 0)
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._state.sizes.clear()
+            self._state.total = 0
+        else:
+            for _ in range(len(self._cache) // self._cull_frequency):
+                self._evict()
+
+    def _delete(self, key):
+        self._forget(key)
+        return super()._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._state.sizes.clear()
+            self._state.total = 0
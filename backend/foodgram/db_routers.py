@@ -0,0 +1,118 @@
+import hashlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+PIN_KEY = 'db-primary:{}'
+
+_routing = ContextVar('db_routing', default=None)
+
+
+class RequestRouting:
+    """ состояние маршрутизации одного запроса """
+    def __init__(self, replica, keys):
+        self.replica = replica
+        self.keys = keys
+        self.wrote = False
+
+
+class PrimaryReplicaRouter:
+    """
+    чтение внутри безопасного запроса - с реплики, все остальное
+    (запись, транзакции, команды и фоновые задачи) - с основной БД
+    """
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if (routing is None or routing.replica is None
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def use_primary():
+    """ дальнейшее чтение в этом запросе - с основной БД """
+    routing = _routing.get()
+    if routing is not None:
+        routing.replica = None
+
+
+def pin_keys(request):
+    """
+    клиент определяется только по токену: за nginx адрес у всех
+    запросов один
+    """
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    return [pin_key(authorization)] if authorization else []
+
+
+def pin_key(authorization):
+    identity = ' '.join(authorization.split())
+    return PIN_KEY.format(hashlib.sha1(identity.encode()).hexdigest())
+
+
+@receiver(user_logged_in)
+def pin_new_token(user, **kwargs):
+    """
+    выданный при входе токен тоже читает с основной БД: первые запросы
+    после входа видят только что созданного пользователя; вход в
+    админку по сессии токена может и не иметь
+    """
+    routing = _routing.get()
+    if routing is None:
+        return
+    key = Token.objects.filter(user=user).values_list(
+        'key', flat=True).first()
+    if key is None:
+        return
+    routing.keys.append(pin_key(f'Token {key}'))
+    routing.wrote = True
+
+
+class ReplicaRoutingMiddleware:
+    """
+    выбирает реплику для безопасных запросов; после записи клиент на
+    DB_REPLICA_PIN_SECONDS читает с основной БД, чтобы видеть свои
+    изменения (избранное, список покупок, подписки)
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        routing = self.start(request)
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        self.finish(routing)
+        return response
+
+    def start(self, request):
+        keys = pin_keys(request)
+        replica = None
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            if not keys or not cache.get_many(keys):
+                replica = random.choice(settings.DATABASE_REPLICAS)
+        return RequestRouting(replica, keys)
+
+    def finish(self, routing):
+        if routing.wrote and routing.keys:
+            cache.set_many(dict.fromkeys(routing.keys, True),
+                           settings.DB_REPLICA_PIN_SECONDS)
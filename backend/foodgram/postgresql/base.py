@@ -0,0 +1,48 @@
+from django.db.backends.postgresql import base
+
+from .pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    бэкенд PostgreSQL с проверкой постоянных соединений
+    (CONN_HEALTH_CHECKS) и необязательным пулом в процессе (POOL)
+    """
+    health_check_done = False
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            connection = super().get_new_connection(conn_params)
+        else:
+            connection = pool.acquire(
+                lambda: super(DatabaseWrapper, self).get_new_connection(
+                    conn_params))
+            self.isolation_level = connection.isolation_level
+        self.health_check_done = True
+        return connection
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            pool.release(self.connection, close=self.in_atomic_block)
+        return None
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (self.connection is not None and not self.health_check_done
+                and not self.in_atomic_block
+                and self.settings_dict.get('CONN_HEALTH_CHECKS')):
+            if not self.is_usable():
+                self.close()
+            self.health_check_done = True
+        super().ensure_connection()
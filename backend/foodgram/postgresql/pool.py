@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from psycopg2 import OperationalError, extensions
+
+logger = logging.getLogger('foodgram.db.pool')
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    пул соединений одного процесса: не больше size открытых соединений,
+    при исчерпании поток ждет до timeout секунд; stats - счетчики
+    выдач, ожиданий и таймаутов
+    """
+    LOG_EVERY = 1000
+
+    def __init__(self, alias, size, timeout, health_checks=False):
+        self.alias = alias
+        self.size = size
+        self.timeout = timeout
+        self.health_checks = health_checks
+        self.idle = []
+        self.opened = 0
+        self.condition = threading.Condition()
+        self.stats = Counter()
+
+    def acquire(self, connect):
+        """ свободное соединение из пула или новое, если есть место """
+        while True:
+            connection, reused = self.checkout(connect)
+            if (not reused or not self.health_checks
+                    or self.is_usable(connection)):
+                return connection
+            with self.condition:
+                self.stats['broken'] += 1
+            self.release(connection, close=True)
+
+    def is_usable(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except Exception:
+            return False
+        return True
+
+    def checkout(self, connect):
+        started = time.monotonic()
+        with self.condition:
+            waited = False
+            while not self.idle and self.opened >= self.size:
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise OperationalError(
+                        f'Пул соединений {self.alias} исчерпан: '
+                        f'{self.size} соединений заняты дольше '
+                        f'{self.timeout} с')
+                waited = True
+                self.condition.wait(remaining)
+            connection = self.idle.pop() if self.idle else None
+            if connection is None:
+                self.opened += 1
+            wait = time.monotonic() - started
+            self.stats['checkouts'] += 1
+            if waited:
+                self.stats['waits'] += 1
+                self.stats['wait_ms'] += int(wait * 1000)
+            self.stats['max_wait_ms'] = max(
+                self.stats['max_wait_ms'], int(wait * 1000))
+            checkouts = self.stats['checkouts']
+        if waited:
+            logger.debug('%s: ожидание соединения %.1f мс',
+                         self.alias, wait * 1000)
+        if checkouts % self.LOG_EVERY == 0:
+            logger.info('%s: %s', self.alias, self.snapshot())
+        if connection is not None:
+            return connection, True
+        try:
+            connection = connect()
+        except Exception:
+            self.discard()
+            raise
+        with self.condition:
+            self.stats['connects'] += 1
+        return connection, False
+
+    def release(self, connection, close=False):
+        """ соединение с незавершенной транзакцией откатывается """
+        if not close and not connection.closed:
+            try:
+                if (connection.get_transaction_status()
+                        != extensions.TRANSACTION_STATUS_IDLE):
+                    connection.rollback()
+            except Exception:
+                close = True
+        if close or connection.closed:
+            try:
+                connection.close()
+            finally:
+                self.discard()
+            return
+        with self.condition:
+            self.idle.append(connection)
+            self.condition.notify()
+
+    def discard(self):
+        with self.condition:
+            self.opened -= 1
+            self.condition.notify()
+
+    def snapshot(self):
+        with self.condition:
+            return dict(self.stats, size=self.size, opened=self.opened,
+                        idle=len(self.idle))
+
+
+def get_pool(alias, settings_dict):
+    """ пул создается в процессе воркера, после fork - заново """
+    options = settings_dict.get('POOL')
+    if not options:
+        return None
+    key = (os.getpid(), alias)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                alias, options.get('SIZE', 1), options.get('TIMEOUT', 10),
+                settings_dict.get('CONN_HEALTH_CHECKS', False))
+        return _pools[key]
+
+
+def pool_stats():
+    """ счетчики пулов текущего процесса """
+    pid = os.getpid()
+    with _pools_lock:
+        pools = [pool for (owner, _), pool in _pools.items() if owner == pid]
+    return {pool.alias: pool.snapshot() for pool in pools}
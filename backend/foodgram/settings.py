@@ -39,6 +39,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'foodgram.db_routers.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -70,8 +71,85 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD', default='foodgram'),
         'HOST': os.getenv('DB_HOST', default='localhost'),
         'PORT': int(os.getenv('DB_PORT', default=5432)),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        # перед первым запросом к БД в каждом запросе соединение
+        # проверяется SELECT 1, разорванное открывается заново
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+# для PostgreSQL - совместимый бэкенд с проверкой соединений и пулом
+if DATABASES['default']['ENGINE'] in (
+        'django.db.backends.postgresql',
+        'django.db.backends.postgresql_psycopg2'):
+    DATABASES['default']['ENGINE'] = 'foodgram.postgresql'
+# пул соединений в процессе воркера: по соединению на поток gunicorn,
+# вернуть соединение в пул после запроса - CONN_MAX_AGE = 0
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', default=4))
+if os.getenv('DB_POOL', default='').lower() in ('1', 'true'):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['POOL'] = {
+        'SIZE': int(os.getenv('DB_POOL_SIZE', default=GUNICORN_THREADS)),
+        'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', default=10)),
+    }
+# pgbouncer в режиме transaction: серверные курсоры iterator() не
+# переживают переключение соединения между транзакциями
+if os.getenv('DB_PGBOUNCER', default='').lower() in ('1', 'true'):
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# реплики только для чтения: DB_REPLICAS=host1,host2:5433 (для sqlite -
+# пути к файлам); безопасные запросы читают с реплики, запись и чтение
+# в течение DB_REPLICA_PIN_SECONDS после записи клиента - с основной БД
+DATABASE_REPLICAS = []
+for number, replica in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', default='').split(',')), 1):
+    alias = f'replica{number}'
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if DATABASES[alias]['ENGINE'].endswith('sqlite3'):
+        DATABASES[alias]['NAME'] = replica
+    else:
+        host, _, port = replica.partition(':')
+        DATABASES[alias]['HOST'] = host
+        DATABASES[alias]['PORT'] = int(port or DATABASES[alias]['PORT'])
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['foodgram.db_routers.PrimaryReplicaRouter']
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', default=5))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # ожидания и счетчики пула соединений (DEBUG - каждое ожидание)
+        'foodgram.db.pool': {
+            'handlers': ['console'],
+            'level': os.getenv('DB_POOL_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
+
+# при нескольких воркерах gunicorn нужен общий для процессов кэш
+# (FileBasedCache или memcached): через него воркеры узнают об изменениях
+# справочников, закэшированных в памяти процесса
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    },
+    # готовые ответы для анонимных пользователей: по умолчанию LRU в памяти
+    # процесса с лимитом размера, можно FileBasedCache или redis
+    # (django_redis.cache.RedisCache); версии для инвалидации - в default
+    'responses': {
+        'BACKEND': os.getenv('RESPONSE_CACHE_BACKEND', default='foodgram.cache_backends.SizeLimitedLocMemCache'),
+        'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', default='foodgram-responses'),
+        'TIMEOUT': int(os.getenv('RESPONSE_CACHE_TIMEOUT', default=600)),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_BYTES': int(os.getenv('RESPONSE_CACHE_MAX_BYTES', default=64 * 1024 * 1024)),
+        },
+    },
+}
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -159,3 +237,56 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 ADMIN_EMAIL = os.getenv('ADMIN_EMAIL')
+
+# уменьшенные копии картинок рецептов: поле модели -> наибольший размер
+RECIPE_IMAGE_RENDITIONS = {
+    'image_card': (480, 480),
+    'image_detail': (1200, 1200),
+}
+RECIPE_IMAGE_FORMAT = os.getenv('RECIPE_IMAGE_FORMAT', default='WEBP')
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+# True - копии создаются сразу в потоке запроса (для отладки)
+RECIPE_IMAGE_SYNC = False
+# ограничения на загружаемую картинку рецепта
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', default=10 * 1024 * 1024))
+RECIPE_IMAGE_MAX_DIMENSION = int(
+    os.getenv('RECIPE_IMAGE_MAX_DIMENSION', default=8000))
+RECIPE_IMAGE_TYPES = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+# сколько живут закэшированные флаги пользователя (избранное, список
+# покупок, подписки); ручки API обновляют их сразу, правки из админки -
+# по истечении времени
+USER_FLAGS_TIMEOUT = int(os.getenv('USER_FLAGS_TIMEOUT', default=300))
+
+# веса для оценок рецептов (update_recipe_scores): добавление в избранное,
+# в список покупок и публикация рецепта (стартовая оценка в трендах)
+RECIPE_SCORE_WEIGHTS = {
+    'favorite': 1.0,
+    'shopping_cart': 1.0,
+    'created': 2.0,
+}
+# за сколько часов вклад добавления в тренды уменьшается вдвое
+RECIPE_TRENDING_HALF_LIFE = float(
+    os.getenv('RECIPE_TRENDING_HALF_LIFE', default=48))
+# через сколько секунд после запуска update_recipe_scores увиденные им
+# добавления учитываются: к этому времени закоммитятся и строки с
+# меньшими id из более долгих транзакций
+RECIPE_SCORE_COMMIT_LAG = 60
+
+# рецепты авторов, у которых подписчиков не больше этого числа,
+# рассылаются во входящие ленты подписок при публикации, рецепты
+# остальных лента подмешивает при чтении
+FEED_FANOUT_MAX_FOLLOWERS = int(
+    os.getenv('FEED_FANOUT_MAX_FOLLOWERS', default=1000))
+
+# сколько рецептов отдает ?search= на базах без полнотекстового поиска
+RECIPE_SEARCH_FALLBACK_LIMIT = 1000
+
+# /api/recipes/match/: сколько лучших совпадений отдается и на сколько
+# секунд назад перечитываются рецепты при обновлении индекса
+MATCH_LIMIT = int(os.getenv('MATCH_LIMIT', default=300))
+MATCH_REFRESH_OVERLAP = 60
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', default=20))
+INGREDIENT_SEARCH_CONTAINS_MIN = 3
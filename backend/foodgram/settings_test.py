@@ -0,0 +1,8 @@
+""" настройки для manage.py test --settings=foodgram.settings_test """
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES
+
+# тестовая sqlite - файлом: база в памяти не ждет блокировок, и тесты
+# с параллельными соединениями падают с 'database table is locked'
+if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+    DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'test_db.sqlite3'}
@@ -0,0 +1,36 @@
+import multiprocessing
+import os
+
+bind = '0.0.0.0:8000'
+# версии справочников, поколения готовых ответов, флаги и состояние
+# пользователей, привязка к основной БД живут в кэше default: воркеры
+# видят изменения друг друга только через общий кэш (CACHE_BACKEND),
+# с LocMemCache по умолчанию воркер один
+local_cache = 'locmem' in os.getenv('CACHE_BACKEND', default='locmem').lower()
+workers = int(os.getenv(
+    'GUNICORN_WORKERS',
+    default=1 if local_cache else multiprocessing.cpu_count() * 2 + 1))
+if workers > 1 and local_cache:
+    raise RuntimeError(
+        f'GUNICORN_WORKERS={workers} требует общего кэша: задайте '
+        'CACHE_BACKEND (FileBasedCache, memcached или redis)')
+# при threads > 1 gunicorn использует воркер gthread; размер пула
+# соединений по умолчанию равен числу потоков (см. DB_POOL в settings.py)
+threads = int(os.getenv('GUNICORN_THREADS', default=4))
+
+
+def when_ready(server):
+    if os.getenv('DB_POOL', default='').lower() in ('1', 'true'):
+        per_worker = int(os.getenv('DB_POOL_SIZE', default=threads))
+    else:
+        per_worker = threads
+    server.log.info(
+        'Соединений с основной БД не больше %s (%s воркеров x %s), '
+        'сверьте с max_connections PostgreSQL или pgbouncer',
+        workers * per_worker, workers, per_worker)
+
+
+def worker_exit(server, worker):
+    from foodgram.postgresql.pool import pool_stats
+    for alias, stats in pool_stats().items():
+        server.log.info('Пул %s воркера %s: %s', alias, worker.pid, stats)
@@ -27,7 +27,8 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = (
         RecipeIngredientInline,
     )
-    list_display = ('name', 'text', 'cooking_time')
+    list_display = ('name', 'text', 'cooking_time', 'favorites_count',
+                    'cart_count')
     search_fields = ('name', 'text', 'ingredients')
     empty_value_display = '- пусто -'
     list_filter = ('author', 'name', 'tags')
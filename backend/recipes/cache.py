@@ -0,0 +1,215 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from users.models import Follow
+from .models import Favorite, Ingredient, ShoppingList, Tag
+from .serializers import IngredientSerializer, TagSerializer
+
+CachedList = namedtuple('CachedList', 'version body etag items')
+UserFlags = namedtuple('UserFlags', 'favorites shopping_cart following')
+USER_STATE_KEY = 'user-state:{}'
+USER_FLAGS_KEY = 'user-flags:{}'
+PROFILE_STATE_KEY = 'profile-state:{}'
+GENERATION_KEY = 'response-generation:{}'
+EPOCH = 'epoch'
+
+
+def make_etag(body):
+    return '"{}"'.format(hashlib.sha1(body).hexdigest())
+
+
+class ReferenceCache:
+    """
+    сериализованный справочник в памяти процесса: готовые json-байты
+    списка и каждой записи. Общий для всех воркеров ключ версии в кэше
+    django меняется при изменении справочника, после чего процессы
+    пересобирают свою копию при следующем запросе
+    """
+    def __init__(self, name, model, serializer_class):
+        self.version_key = f'reference:{name}:version'
+        self.model = model
+        self.serializer_class = serializer_class
+        self._lock = threading.Lock()
+        self._entry = None
+
+    def version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid.uuid4().hex, timeout=None)
+            version = cache.get(self.version_key)
+        return version
+
+    def invalidate(self):
+        cache.set(self.version_key, uuid.uuid4().hex, timeout=None)
+
+    def get(self):
+        version = self.version()
+        entry = self._entry
+        if entry is not None and entry.version == version:
+            return entry
+        with self._lock:
+            entry = self._entry
+            if entry is None or entry.version != version:
+                entry = self._entry = self._build(version)
+        return entry
+
+    def _build(self, version):
+        renderer = JSONRenderer()
+        data = self.serializer_class(
+            self.model.objects.all(), many=True).data
+        body = renderer.render(data)
+        items = {}
+        for item in data:
+            item_body = renderer.render(item)
+            items[item['id']] = (item_body, make_etag(item_body))
+        return CachedList(version, body, make_etag(body), items)
+
+
+tags_cache = ReferenceCache('tags', Tag, TagSerializer)
+ingredients_cache = ReferenceCache('ingredients', Ingredient,
+                                   IngredientSerializer)
+
+
+def user_state_version(user):
+    """
+    время последнего изменения избранного, списка покупок или подписок
+    пользователя: входит в валидаторы ответов с его флагами
+    """
+    if user.is_anonymous:
+        return 0
+    return time_version(USER_STATE_KEY.format(user.id))
+
+
+def touch_user_state(user):
+    cache.set(USER_STATE_KEY.format(user.id), time.time(), timeout=None)
+
+
+def profile_version(user_id='any'):
+    """
+    время последнего изменения профиля автора user_id ('any' - любого):
+    имя и юзернэйм автора входят в ответы с рецептами
+    """
+    return time_version(PROFILE_STATE_KEY.format(user_id))
+
+
+def touch_profile(user_id):
+    def touch():
+        now = time.time()
+        cache.set_many({
+            PROFILE_STATE_KEY.format(user_id): now,
+            PROFILE_STATE_KEY.format('any'): now,
+        }, timeout=None)
+    transaction.on_commit(touch)
+
+
+def time_version(key):
+    """ время из общего кэша; пропавшее заменяется текущим """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+class UserFlagsCache:
+    """
+    id рецептов в избранном и в списке покупок и id авторов в подписках
+    пользователя - по запросу на каждое множество при промахе; ручки
+    добавления/удаления сбрасывают запись после коммита
+    """
+    def get(self, user):
+        key = USER_FLAGS_KEY.format(user.id)
+        flags = cache.get(key)
+        if flags is None:
+            flags = self.load(user)
+            cache.set(key, flags, settings.USER_FLAGS_TIMEOUT)
+        return flags
+
+    def load(self, user):
+        return UserFlags(
+            favorites=set(Favorite.objects.filter(
+                user=user).values_list('recipe_id', flat=True)),
+            shopping_cart=set(ShoppingList.objects.filter(
+                user=user).values_list('recipe_id', flat=True)),
+            following=set(Follow.objects.filter(
+                user=user).values_list('following_id', flat=True)),
+        )
+
+    def invalidate(self, user):
+        """
+        ключ удаляется после коммита, следующее чтение соберет множества
+        заново: чтение-изменение-запись теряло одновременные обновления
+        """
+        key = USER_FLAGS_KEY.format(user.id)
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+user_flags = UserFlagsCache()
+
+
+class ResponseCache:
+    """
+    готовые ответы в отдельном кэше alias. Запись помнит поколения
+    зависимостей (recipe:1, author:2, tag:breakfast, recipes, tags,
+    ingredients) из общего кэша и при чтении сверяет их: invalidate
+    меняет поколения после коммита, затронутые записи перестают
+    совпадать. Запись не сохраняется, если за время ее построения
+    сменилась эпоха (любая инвалидация)
+    """
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def store(self):
+        return caches[self.alias]
+
+    def key(self, kind, params):
+        normalized = repr((kind, sorted(params)))
+        return 'response:{}:{}'.format(
+            kind, hashlib.sha1(normalized.encode()).hexdigest())
+
+    def generations(self, names):
+        keys = {GENERATION_KEY.format(name): name for name in names}
+        found = cache.get_many(keys)
+        for key in keys.keys() - found.keys():
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            found[key] = cache.get(key)
+        return {keys[key]: generation for key, generation in found.items()}
+
+    def epoch(self):
+        return self.generations([EPOCH])[EPOCH]
+
+    def get(self, key):
+        """ (body, etag) или None, если записи нет или она устарела """
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+        body, etag, generations = entry
+        if self.generations(generations) != generations:
+            return None
+        return body, etag
+
+    def set(self, key, epoch, body, etag, names):
+        generations = self.generations(set(names) | {EPOCH})
+        if generations.pop(EPOCH) != epoch:
+            return
+        self.store.set(key, (body, etag, generations))
+
+    def invalidate(self, *names):
+        def bump():
+            cache.set_many({
+                GENERATION_KEY.format(name): uuid.uuid4().hex
+                for name in set(names) | {EPOCH}
+            }, timeout=None)
+        transaction.on_commit(bump)
+
+
+response_cache = ResponseCache('responses')
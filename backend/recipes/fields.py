@@ -0,0 +1,116 @@
+import base64
+import binascii
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
+from rest_framework import serializers
+
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+class RecipeImageField(serializers.ImageField):
+    """
+    уменьшенная копия картинки, пока ее нет - оригинал; вьюсет может
+    выбрать копию через контекст сериалайзера image_rendition
+    """
+    def __init__(self, rendition, **kwargs):
+        self.rendition = rendition
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        rendition = self.context.get('image_rendition', self.rendition)
+        return getattr(instance, rendition) or instance.image
+
+
+class StreamingBase64ImageField(serializers.ImageField):
+    """
+    картинка строкой base64 (data:image/...;base64,...) или файлом из
+    multipart; base64 декодируется по кускам во временный файл, а
+    картинка проверяется только по заголовку, без декодирования пикселей
+    """
+    default_error_messages = {
+        'invalid': 'Картинка должна быть строкой base64 или файлом.',
+        'invalid_base64': 'Некорректная строка base64.',
+        'invalid_image': 'Загрузите корректную картинку.',
+        'invalid_type': 'Допустимые форматы картинки: {types}.',
+        'too_large': 'Картинка больше {max_size} байт.',
+        'too_big': 'Стороны картинки должны быть не больше {max_dimension}.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            file = data.file
+        elif isinstance(data, str):
+            file = self.decode(data)
+        else:
+            self.fail('invalid')
+        try:
+            image_format = self.check_image(file)
+        except serializers.ValidationError:
+            if isinstance(data, str):
+                file.close()
+            raise
+        name = f'{uuid.uuid4()}.{image_format.lower()}'
+        return File(file, name=name)
+
+    def spooled_file(self):
+        return tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+            dir=settings.FILE_UPLOAD_TEMP_DIR,
+        )
+
+    def decode(self, data):
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if ';base64,' in data:
+            start = data.index(';base64,') + len(';base64,')
+        else:
+            start = 0
+        if (len(data) - start) // 4 * 3 > max_size + 3:
+            self.fail('too_large', max_size=max_size)
+        file = self.spooled_file()
+        tail = ''
+        try:
+            for offset in range(start, len(data), BASE64_CHUNK_SIZE):
+                chunk = tail + ''.join(
+                    data[offset:offset + BASE64_CHUNK_SIZE].split())
+                cut = len(chunk) // 4 * 4
+                tail = chunk[cut:]
+                file.write(base64.b64decode(chunk[:cut], validate=True))
+            if tail:
+                file.write(base64.b64decode(tail, validate=True))
+        except (binascii.Error, ValueError):
+            file.close()
+            self.fail('invalid_base64')
+        if file.tell() > max_size:
+            file.close()
+            self.fail('too_large', max_size=max_size)
+        file.seek(0)
+        return file
+
+    def check_image(self, file):
+        """ формат и размеры из заголовка картинки """
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        file.seek(0, 2)
+        if file.tell() > max_size:
+            self.fail('too_large', max_size=max_size)
+        file.seek(0)
+        try:
+            with Image.open(file) as image:
+                image_format = image.format
+                width, height = image.size
+        except (OSError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        finally:
+            file.seek(0)
+        if image_format not in settings.RECIPE_IMAGE_TYPES:
+            self.fail('invalid_type',
+                      types=', '.join(settings.RECIPE_IMAGE_TYPES))
+        max_dimension = settings.RECIPE_IMAGE_MAX_DIMENSION
+        if width > max_dimension or height > max_dimension:
+            self.fail('too_big', max_dimension=max_dimension)
+        return image_format
@@ -1,19 +1,59 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import (Case, Exists, F, FloatField, IntegerField,
+                              OuterRef, Value, When)
+from django.db.models.functions import Cast
 from django_filters import rest_framework as filters
 
-from .models import Ingredient, Recipe
+from .models import Favorite, Ingredient, Recipe, ShoppingList, Tag
+from .search import ingredient_index, recipe_index
 
 
 class IngredientFilter(filters.FilterSet):
-    name = filters.CharFilter(field_name='name', lookup_expr='istartswith')
+    """
+    поиск ингредиентов для автодополнения: сначала совпадения по префиксу,
+    затем по вхождению, не больше INGREDIENT_SEARCH_LIMIT результатов
+    """
+    name = filters.CharFilter(method='search_name')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def search_name(self, queryset, name, value):
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+        contains = len(value) >= settings.INGREDIENT_SEARCH_CONTAINS_MIN
+        if connections[queryset.db].vendor != 'postgresql':
+            ids = ingredient_index.search(value, limit, contains)
+            if not ids:
+                return queryset.none()
+            return queryset.filter(id__in=ids).order_by(Case(
+                *[When(id=pk, then=Value(position))
+                  for position, pk in enumerate(ids)],
+                output_field=IntegerField(),
+            ))
+        if contains:
+            queryset = queryset.filter(name__icontains=value)
+        else:
+            queryset = queryset.filter(name__istartswith=value)
+        return queryset.annotate(is_prefix=Case(
+            When(name__istartswith=value, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )).order_by('is_prefix', 'name')[:limit]
+
 
 class RecipeFilter(filters.FilterSet):
-    tags = filters.AllValuesMultipleFilter(
-        field_name='tags__slug',
+    """
+    фильтры рецептов: каждый добавляет к входящей выборке подзапрос
+    EXISTS, поэтому они сочетаются между собой, не дают дублей строк
+    и не требуют DISTINCT
+    """
+    tags = filters.ModelMultipleChoiceFilter(
+        queryset=Tag.objects.all(),
+        to_field_name='slug',
+        method='filter_tags',
         label='Tags',
     )
     is_favorited = filters.BooleanFilter(
@@ -24,6 +64,15 @@ class RecipeFilter(filters.FilterSet):
         method='get_shopping',
         label='Is in shopping list',
     )
+    search = filters.CharFilter(
+        method='search_recipes',
+        label='Search',
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'popular'), ('trending', 'trending')),
+        method='order_by_score',
+        label='Ordering',
+    )
 
     class Meta:
         model = Recipe
@@ -31,15 +80,59 @@ class RecipeFilter(filters.FilterSet):
             'is_favorited',
             'author',
             'tags',
-            'is_in_shopping_cart'
+            'is_in_shopping_cart',
+            'search',
+            'ordering',
         )
 
+    scores = {'popular': 'popularity', 'trending': 'trending'}
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=value)))
+
+    def filter_user_recipes(self, queryset, model, value):
+        if not value:
+            return queryset
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(model.objects.filter(
+            user=user, recipe=OuterRef('pk'))))
+
     def get_favorite(self, queryset, name, value):
-        if value:
-            return Recipe.objects.filter(in_favorite__user=self.request.user)
-        return Recipe.objects.all()
+        return self.filter_user_recipes(queryset, Favorite, value)
 
     def get_shopping(self, queryset, name, value):
-        if value:
-            return Recipe.objects.filter(shoppinglist__user=self.request.user)
-        return Recipe.objects.all()
+        return self.filter_user_recipes(queryset, ShoppingList, value)
+
+    def search_recipes(self, queryset, name, value):
+        """
+        полнотекстовый поиск по названию, ингредиентам и тексту,
+        результаты по убыванию search_rank (?ordering= его заменяет)
+        """
+        if connections[queryset.db].vendor != 'postgresql':
+            found = recipe_index.search(
+                value, settings.RECIPE_SEARCH_FALLBACK_LIMIT)
+            if not found:
+                return queryset.none()
+            rank = Case(
+                *[When(id=pk, then=Value(weight)) for pk, weight in found],
+                output_field=FloatField(),
+            )
+            return queryset.filter(id__in=[pk for pk, _ in found]).annotate(
+                search_rank=rank).order_by('-search_rank', '-id')
+        query = (SearchQuery(value, config='russian', search_type='websearch')
+                 | SearchQuery(value, config='english',
+                               search_type='websearch'))
+        # ts_rank - real: в double precision, чтобы позиция курсора
+        # совпадала со значением в базе
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=Cast(SearchRank(F('search_vector'), query),
+                             FloatField())
+        ).order_by('-search_rank', '-id')
+
+    def order_by_score(self, queryset, name, value):
+        return queryset.ranked(self.scores[value])
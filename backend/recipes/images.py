@@ -0,0 +1,95 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """ пул создается лениво, уже в процессе воркера после fork """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-images',
+            )
+    return _executor
+
+
+def schedule_renditions(recipe_id):
+    """ после коммита ставит создание уменьшенных копий в фоновый пул """
+    if settings.RECIPE_IMAGE_SYNC:
+        transaction.on_commit(lambda: make_renditions(recipe_id))
+    else:
+        transaction.on_commit(
+            lambda: get_executor().submit(run_renditions, recipe_id))
+
+
+def run_renditions(recipe_id):
+    close_old_connections()
+    try:
+        make_renditions(recipe_id)
+    except Exception:
+        logger.exception('Не удалось обработать картинку рецепта %s',
+                         recipe_id)
+    finally:
+        close_old_connections()
+
+
+def render(image, size, image_format):
+    copy = image.copy()
+    copy.thumbnail(size, Image.LANCZOS)
+    if image_format == 'JPEG' and copy.mode != 'RGB':
+        copy = copy.convert('RGB')
+    buffer = io.BytesIO()
+    copy.save(buffer, image_format, quality=85)
+    return buffer.getvalue()
+
+
+def make_renditions(recipe_id):
+    """
+    создает уменьшенные копии картинки рецепта; если пока шла обработка
+    картинку заменили, результат выбрасывается
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).only('id', 'image').first()
+    if recipe is None or not recipe.image:
+        return
+    source = recipe.image.name
+    largest = max(settings.RECIPE_IMAGE_RENDITIONS.values())
+    with recipe.image.open('rb') as file:
+        image = Image.open(file)
+        image.draft('RGB', largest)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    image_format = settings.RECIPE_IMAGE_FORMAT
+    stem = os.path.splitext(os.path.basename(source))[0]
+    names = {}
+    for field_name, size in settings.RECIPE_IMAGE_RENDITIONS.items():
+        field = Recipe._meta.get_field(field_name)
+        name = field.generate_filename(
+            recipe, f'{stem}.{image_format.lower()}')
+        names[field_name] = field.storage.save(
+            name, ContentFile(render(image, size, image_format)))
+    updated = Recipe.objects.filter(pk=recipe_id, image=source).update(
+        updated_at=timezone.now(), **names)
+    if updated:
+        # cache импортирует сериалайзеры, а они - этот модуль
+        from .cache import response_cache
+        response_cache.invalidate(f'recipe:{recipe_id}')
+    else:
+        for field_name, name in names.items():
+            Recipe._meta.get_field(field_name).storage.delete(name)
@@ -0,0 +1,117 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Нагрузить запущенный сервер GET-запросами: N клиентов с '
+            'keep-alive, итог - запросов в секунду и перцентили задержки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='URL, по кругу')
+        parser.add_argument('-c', '--concurrency', type=int, default=200)
+        parser.add_argument('-d', '--duration', type=float, default=20,
+                            help='Секунд нагрузки')
+        parser.add_argument('-H', '--header', action='append', default=[],
+                            help='Заголовок, например "Authorization: '
+                                 'Token ..."')
+
+    def handle(self, *args, **options):
+        targets = []
+        for url in options['urls']:
+            parts = urlsplit(url)
+            if parts.scheme != 'http':
+                raise CommandError(f'Поддерживается только http: {url}')
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            targets.append((parts.hostname, parts.port or 80, path))
+        latencies, errors, elapsed = asyncio.run(self.run(
+            targets, options['concurrency'], options['duration'],
+            options['header']))
+        if not latencies:
+            raise CommandError(f'Ни одного успешного ответа, ошибок: '
+                               f'{errors}')
+        latencies.sort()
+
+        def percentile(share):
+            return latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * share))] * 1000
+
+        self.stdout.write(
+            f'клиентов: {options["concurrency"]}, '
+            f'ответов: {len(latencies)}, ошибок: {errors}\n'
+            f'запросов/с: {len(latencies) / elapsed:.1f}\n'
+            f'задержка, мс: средняя {statistics.mean(latencies) * 1000:.1f}'
+            f', p50 {percentile(0.5):.1f}, p95 {percentile(0.95):.1f}, '
+            f'p99 {percentile(0.99):.1f}'
+        )
+
+    async def run(self, targets, concurrency, duration, headers):
+        latencies = []
+        errors = [0]
+        started = time.monotonic()
+        deadline = started + duration
+        await asyncio.gather(*(
+            self.client(number, targets, headers, deadline, latencies,
+                        errors)
+            for number in range(concurrency)
+        ))
+        return latencies, errors[0], time.monotonic() - started
+
+    async def client(self, number, targets, headers, deadline, latencies,
+                     errors):
+        connection = None
+        request_number = number
+        while time.monotonic() < deadline:
+            host, port, path = targets[request_number % len(targets)]
+            request_number += 1
+            request = ''.join(
+                [f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\n']
+                + [f'{header}\r\n' for header in headers]
+                + ['\r\n']).encode()
+            started = time.monotonic()
+            try:
+                if connection is None:
+                    connection = await asyncio.open_connection(host, port)
+                reader, writer = connection
+                writer.write(request)
+                status, keep_alive = await self.read_response(reader)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors[0] += 1
+                connection = await self.close(connection)
+                continue
+            if status == 200:
+                latencies.append(time.monotonic() - started)
+            else:
+                errors[0] += 1
+            if not keep_alive:
+                connection = await self.close(connection)
+        await self.close(connection)
+
+    async def read_response(self, reader):
+        head = await reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip().lower()
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0],
+                           16)
+                await reader.readexactly(size + 2)
+                if not size:
+                    break
+        else:
+            await reader.readexactly(int(headers.get('content-length', 0)))
+        return status, headers.get('connection') != 'close'
+
+    async def close(self, connection):
+        if connection is not None:
+            connection[1].close()
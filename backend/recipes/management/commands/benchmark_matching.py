@@ -0,0 +1,108 @@
+import random
+import time
+import tracemalloc
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+
+from recipes.matching import IngredientMatcher
+
+
+class Command(BaseCommand):
+    help = ('Замерить подбор рецептов по ингредиентам на синтетических '
+            'данных в памяти (база не нужна): сборка индекса, память, '
+            'задержка запросов и обновлений, для сравнения - перебор '
+            'рецептов с пересечением множеств')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=300)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # популярность ингредиентов - по закону Ципфа: соль и масло почти
+        # везде, большинство ингредиентов - в единицах рецептов
+        cum_weights = list(accumulate(
+            1 / rank for rank in range(1, options['ingredients'] + 1)))
+
+        def sample(low, high):
+            size = rng.randint(low, high)
+            chosen = set()
+            while len(chosen) < size:
+                chosen.update(rng.choices(
+                    range(1, options['ingredients'] + 1),
+                    cum_weights=cum_weights, k=size - len(chosen)))
+            return chosen
+
+        recipes = [sample(3, 15) for _ in range(options['recipes'])]
+        rows = [(recipe_id, ingredient_id)
+                for recipe_id, ingredients in enumerate(recipes, start=1)
+                for ingredient_id in sorted(ingredients)]
+
+        matcher = IngredientMatcher()
+        tracemalloc.start()
+        started = time.perf_counter()
+        matcher.load(rows)
+        build = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        stats = matcher.stats()
+        self.stdout.write(
+            f'рецептов: {stats["recipes"]}, ингредиентов: '
+            f'{stats["ingredients"]}, пар: {stats["pairs"]}\n'
+            f'сборка: {build:.2f} с, индекс: {stats["bytes"] / 2 ** 20:.1f} '
+            f'МБ, пик при сборке: {peak / 2 ** 20:.1f} МБ')
+
+        queries = [sample(5, 20) for _ in range(options['queries'])]
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            matcher.match(query, options['limit'])
+            latencies.append(time.perf_counter() - started)
+        self.report('запрос', latencies)
+
+        latencies = []
+        for _ in range(100):
+            recipe_id = rng.randint(1, options['recipes'])
+            started = time.perf_counter()
+            recipes[recipe_id - 1] = sample(3, 15)
+            matcher._replace(recipe_id, recipes[recipe_id - 1])
+            latencies.append(time.perf_counter() - started)
+        self.report('обновление рецепта', latencies)
+
+        latencies = []
+        mismatches = 0
+        for query in queries[:10]:
+            started = time.perf_counter()
+            found = []
+            for recipe_id, ingredients in enumerate(recipes, start=1):
+                matched = len(ingredients & query)
+                if matched:
+                    found.append((recipe_id, matched, len(ingredients)))
+            found.sort(key=lambda item: (
+                -item[1] / item[2], item[2] - item[1], -item[0]))
+            latencies.append(time.perf_counter() - started)
+            if found[:options['limit']] != matcher.match(
+                    query, options['limit']):
+                mismatches += 1
+        self.report('перебор множеств', latencies)
+        if mismatches:
+            self.stdout.write(self.style.ERROR(
+                f'Результаты расходятся с перебором: {mismatches} из 10'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                'Результаты совпадают с перебором'))
+
+    def report(self, name, latencies):
+        latencies = sorted(latencies)
+
+        def percentile(share):
+            return latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * share))] * 1000
+
+        self.stdout.write(
+            f'{name}, мс: p50 {percentile(0.5):.2f}, '
+            f'p95 {percentile(0.95):.2f}, p99 {percentile(0.99):.2f}')
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import ShoppingListTotal
+
+
+class Command(BaseCommand):
+    help = ('Пересчитать итоги списков покупок с нуля и сравнить '
+            'с сохраненными')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Заменить сохраненные итоги пересчитанными',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            computed = {
+                (user, ingredient): total
+                for user, ingredient, total
+                in ShoppingListTotal.objects.computed()
+            }
+            stored = {
+                (user, ingredient): amount
+                for user, ingredient, amount
+                in ShoppingListTotal.objects.values_list(
+                    'user', 'ingredient', 'amount')
+            }
+            diff = sorted(
+                key for key in computed.keys() | stored.keys()
+                if computed.get(key) != stored.get(key)
+            )
+            for user, ingredient in diff:
+                self.stdout.write(
+                    f'user={user} ingredient={ingredient}: '
+                    f'сохранено {stored.get((user, ingredient))}, '
+                    f'должно быть {computed.get((user, ingredient))}'
+                )
+            if diff and options['fix']:
+                ShoppingListTotal.objects.all().delete()
+                ShoppingListTotal.objects.bulk_create(
+                    (ShoppingListTotal(
+                        user_id=user, ingredient_id=ingredient, amount=total)
+                     for (user, ingredient), total in computed.items()),
+                    batch_size=1000,
+                )
+        if not diff:
+            self.stdout.write(self.style.SUCCESS('Итоги совпадают'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Исправлено расхождений: {len(diff)}'))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f'Найдено расхождений: {len(diff)}'))
@@ -1,22 +1,172 @@
 import csv
+import io
+import json
+import time
+from itertools import islice
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
 
+from recipes.cache import ingredients_cache
 from recipes.models import Ingredient
 
+DEFAULT_PATH = settings.BASE_DIR / 'recipes' / 'data' / 'ingredients.csv'
+FIXTURE_MODEL = 'recipes.ingredient'
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
 
 class Command(BaseCommand):
-    help = 'Загрузить таблицу ингридиентов в БД'
+    help = ('Загрузить таблицу ингридиентов в БД из csv или json-фикстуры, '
+            'повторный запуск не создает дублей')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            default=[str(DEFAULT_PATH)],
+            help='csv (название,единица) или json-фикстуры dumpdata',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Размер пачки для bulk_create',
+        )
 
     def handle(self, *args, **options):
-        id = 0
-        with open('recipes/data/ingredients.csv', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            for line in reader:
-                name, unit = line
-                Ingredient.objects.get_or_create(
-                    id=id,
-                    name=name,
-                    measurement_unit=unit
-                    )
-                id += 1
+        for path in options['paths']:
+            started = time.monotonic()
+            before = Ingredient.objects.count()
+            if path.endswith('.json'):
+                rows = self.read_fixture(path)
+                with_ids = True
+            else:
+                rows = None
+                with_ids = False
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    total = self.copy_rows(path, rows, with_ids)
+                else:
+                    total = self.bulk_rows(
+                        path, rows, with_ids, options['chunk_size'])
+                if with_ids:
+                    self.reset_sequence()
+                    self.report_skipped(path, rows)
+            ingredients_cache.invalidate()
+            elapsed = time.monotonic() - started
+            created = Ingredient.objects.count() - before
+            self.stdout.write(self.style.SUCCESS(
+                f'{path}: прочитано {total}, добавлено {created} за '
+                f'{elapsed:.2f} с ({total / max(elapsed, 1e-6):.0f} строк/с)'
+            ))
+
+    def read_fixture(self, path):
+        with open(path, encoding='utf-8') as file:
+            objects = json.load(file)
+        rows = [
+            (obj.get('pk'), obj['fields']['name'],
+             obj['fields']['measurement_unit'])
+            for obj in objects if obj['model'] == FIXTURE_MODEL
+        ]
+        skipped = len(objects) - len(rows)
+        if skipped:
+            self.stdout.write(
+                f'{path}: пропущено объектов других моделей: {skipped}, '
+                f'для них используйте loaddata')
+        return rows
+
+    def bulk_rows(self, path, rows, with_ids, chunk_size):
+        total = 0
+        file = None
+        if rows is None:
+            file = open(path, encoding='utf-8', newline='')
+            rows = ((None, name, unit) for name, unit in csv.reader(file))
+        try:
+            for chunk in chunked(rows, chunk_size):
+                Ingredient.objects.bulk_create(
+                    (Ingredient(id=pk if with_ids else None,
+                                name=name, measurement_unit=unit)
+                     for pk, name, unit in chunk),
+                    ignore_conflicts=True,
+                )
+                total += len(chunk)
+        finally:
+            if file is not None:
+                file.close()
+        return total
+
+    def copy_rows(self, path, rows, with_ids):
+        """ COPY во временную таблицу и слияние одним INSERT """
+        table = Ingredient._meta.db_table
+        columns = ('id, ' if with_ids else '') + 'name, measurement_unit'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_staging '
+                '(id bigint, name varchar(200), '
+                'measurement_unit varchar(200)) ON COMMIT DROP')
+            copy_sql = (f'COPY ingredient_staging ({columns}) '
+                        'FROM STDIN WITH (FORMAT csv)')
+            if rows is None:
+                with open(path, encoding='utf-8') as file:
+                    cursor.copy_expert(copy_sql, file)
+            else:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+            cursor.execute('SELECT count(*) FROM ingredient_staging')
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT DISTINCT ON (name, measurement_unit) {columns} '
+                'FROM ingredient_staging ON CONFLICT DO NOTHING')
+        return total
+
+    def report_skipped(self, path, rows):
+        """
+        строки фикстуры, которые не попали в таблицу: id занят другим
+        ингредиентом или (название, единица) уже есть под другим id
+        """
+        skipped = 0
+        for chunk in chunked(rows, 1000):
+            by_id = {
+                pk: (name, unit) for pk, name, unit
+                in Ingredient.objects.filter(
+                    id__in=[pk for pk, _, _ in chunk]
+                ).values_list('id', 'name', 'measurement_unit')
+            }
+            by_name = {
+                (name, unit): pk for pk, name, unit
+                in Ingredient.objects.filter(
+                    name__in=[name for _, name, _ in chunk]
+                ).values_list('id', 'name', 'measurement_unit')
+            }
+            for pk, name, unit in chunk:
+                if pk is None or by_id.get(pk) == (name, unit):
+                    continue
+                skipped += 1
+                if (name, unit) in by_name:
+                    reason = f'уже есть с id {by_name[(name, unit)]}'
+                else:
+                    reason = 'id занят: {} ({})'.format(*by_id[pk])
+                self.stdout.write(self.style.WARNING(
+                    f'{path}: пропущен id {pk} {name} ({unit}) - {reason}'))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'{path}: пропущено строк фикстуры: {skipped}'))
+
+    def reset_sequence(self):
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                    no_style(), [Ingredient]):
+                cursor.execute(sql)
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from recipes.images import make_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Создать уменьшенные копии картинок рецептов, для которых их '
+            'еще нет (например, задача потерялась при перезапуске воркера)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать копии для всех рецептов',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            missing = Q()
+            for field_name in settings.RECIPE_IMAGE_RENDITIONS:
+                missing |= Q(**{field_name: ''})
+            recipes = recipes.filter(missing)
+        count = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            make_renditions(recipe_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано рецептов: {count}'))
@@ -0,0 +1,67 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingList
+from users.models import Follow
+
+User = get_user_model()
+
+# модель, счетчик, модель со строками для подсчета, ее ссылка на модель
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'cart_count', ShoppingList, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'following'),
+)
+
+
+def counted(model, field):
+    """ COUNT(*) строк model, ссылающихся полем field на текущую строку """
+    return Coalesce(models.Subquery(
+        model.objects.filter(**{field: models.OuterRef('pk')}).order_by()
+        .values(field).annotate(total=models.Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ('Сверить счетчики рецептов и пользователей с COUNT(*) и '
+            'исправить расхождения (запускать периодически, например '
+            'из cron: правки из админки и каскадные удаления счетчики '
+            'не обновляют)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения',
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for model, counter, counted_model, field in COUNTERS:
+            actual = counted(counted_model, field)
+            drifted = list(
+                model.objects.annotate(actual=actual)
+                .exclude(**{counter: models.F('actual')})
+                .values_list('pk', counter, 'actual')
+            )
+            for pk, stored, value in drifted:
+                self.stdout.write(
+                    f'{model._meta.model_name}={pk} {counter}: '
+                    f'сохранено {stored}, должно быть {value}')
+            if drifted and not options['dry_run']:
+                with transaction.atomic():
+                    model.objects.filter(
+                        pk__in=[pk for pk, _, _ in drifted]
+                    ).update(**{counter: actual})
+            total += len(drifted)
+        if not total:
+            self.stdout.write(self.style.SUCCESS('Счетчики совпадают'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.ERROR(
+                f'Найдено расхождений: {total}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Исправлено расхождений: {total}'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.scores import update_scores
+
+
+class Command(BaseCommand):
+    help = ('Пересчитать оценки рецептов для сортировки ?ordering=popular '
+            'и /api/recipes/trending/ по добавлениям в избранное и списки '
+            'покупок с прошлого запуска (запускать из cron раз в несколько '
+            'минут)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help=('Пересчитать популярность всех рецептов по счетчикам '
+                  '(учитывает удаления, например раз в сутки)'),
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пачки для bulk_update',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        new_rows, recipes = update_scores(
+            full=options['full'], batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Новых добавлений в избранное: {new_rows["favorite"]}, '
+            f'в списки покупок: {new_rows["shopping_cart"]}, '
+            f'пересчитано рецептов: {recipes} за {elapsed:.2f} с'
+        ))
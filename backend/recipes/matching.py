@@ -0,0 +1,265 @@
+import bisect
+import threading
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .models import Recipe, RecipeIngredient
+
+# ингредиент хранится битовым множеством, если он есть хотя бы в одном
+# рецепте из BITSET_SHARE (такое множество не больше чем в 8 раз
+# длиннее массива id), иначе - отсортированным array id рецептов
+BITSET_SHARE = 256
+
+
+def grow(sizes, recipe_id):
+    """ дополняет array нулями до индекса recipe_id """
+    if recipe_id >= len(sizes):
+        sizes.frombytes(bytes(sizes.itemsize * (recipe_id + 1 - len(sizes))))
+
+
+def to_bitset(recipe_ids):
+    """ int, в котором выставлены биты с номерами recipe_ids """
+    if not recipe_ids:
+        return 0
+    buffer = bytearray(max(recipe_ids) // 8 + 1)
+    for recipe_id in recipe_ids:
+        buffer[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def add_one(planes, bits):
+    """
+    прибавляет 1 к счетчикам рецептов из bits; счетчики - побитовые
+    срезы: planes[j] - j-е биты счетчиков всех рецептов
+    """
+    for position, plane in enumerate(planes):
+        planes[position] = plane ^ bits
+        bits &= plane
+        if not bits:
+            return
+    planes.append(bits)
+
+
+def split(planes, bits):
+    """ {значение счетчика: рецепты из bits с таким значением} """
+    groups = {0: bits}
+    for position, plane in enumerate(planes):
+        next_groups = {}
+        for value, group in groups.items():
+            high = group & plane
+            if high:
+                next_groups[value | 1 << position] = high
+            low = group & ~plane
+            if low:
+                next_groups[value] = low
+        groups = next_groups
+    return groups
+
+
+def set_counter(planes, recipe_id, value):
+    bit = 1 << recipe_id
+    while len(planes) < value.bit_length():
+        planes.append(0)
+    for position, plane in enumerate(planes):
+        if value >> position & 1:
+            planes[position] = plane | bit
+        elif plane & bit:
+            planes[position] = plane & ~bit
+
+
+def take_ranked(matched_groups, size_groups, limit, max_missing):
+    """
+    до limit рецептов из пересечений групп: по убыванию доли имеющихся
+    ингредиентов, затем по числу недостающих, затем по убыванию id
+    """
+    ranks = {}
+    for matched in matched_groups:
+        for size in size_groups:
+            if matched <= size and (max_missing is None
+                                    or size - matched <= max_missing):
+                # при полном совпадении ранг у всех размеров один
+                ranks.setdefault(
+                    (-matched / size, size - matched), []
+                ).append((matched, size))
+    found = []
+    for rank in sorted(ranks):
+        groups = [
+            [matched_groups[matched] & size_groups[size], matched, size]
+            for matched, size in ranks[rank]
+        ]
+        groups = [group for group in groups if group[0]]
+        while groups and len(found) < limit:
+            group = max(groups, key=lambda group: group[0].bit_length())
+            recipe_id = group[0].bit_length() - 1
+            found.append((recipe_id, group[1], group[2]))
+            group[0] ^= 1 << recipe_id
+            if not group[0]:
+                groups.remove(group)
+        if len(found) >= limit:
+            break
+    return found
+
+
+class IngredientMatcher:
+    """
+    индекс «что приготовить из того, что есть» в памяти процесса.
+    Рецепты ингредиента - битовое множество (int, бит = id рецепта)
+    для частых ингредиентов и отсортированный array id для редких,
+    число ингредиентов рецептов - побитовые срезы. Запрос складывает
+    множества своих ингредиентов в такие же срезы-счетчики и делит
+    рецепты на группы (есть ингредиентов, всего) операциями над
+    целыми множествами, без цикла по рецептам; из групп в порядке
+    покрытия берутся id, пока не наберется limit. Изменения
+    подтягиваются при запросах по updated_at рецептов
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bitsets = {}
+        self._postings = {}
+        self._sizes = array('H')
+        self._size_planes = []
+        self._recipes = 0
+        self._state = None
+        self._synced_at = None
+
+    def load(self, rows):
+        """ полная сборка из пар (recipe_id, ingredient_id) """
+        with self._lock:
+            self._load(rows)
+
+    def _load(self, rows):
+        postings = {}
+        sizes = array('H')
+        for recipe_id, ingredient_id in rows:
+            grow(sizes, recipe_id)
+            sizes[recipe_id] += 1
+            postings.setdefault(ingredient_id, array('I')).append(recipe_id)
+        self._bitsets = {}
+        for ingredient_id, recipe_ids in list(postings.items()):
+            if len(recipe_ids) * BITSET_SHARE >= len(sizes):
+                self._bitsets[ingredient_id] = to_bitset(recipe_ids)
+                del postings[ingredient_id]
+            elif any(a > b for a, b in zip(recipe_ids, recipe_ids[1:])):
+                recipe_ids[:] = array('I', sorted(recipe_ids))
+        self._postings = postings
+        self._sizes = sizes
+        self._size_planes = [
+            to_bitset([recipe_id for recipe_id, size in enumerate(sizes)
+                       if size >> position & 1])
+            for position in range(max(sizes, default=0).bit_length())
+        ]
+        self._recipes = sum(1 for size in sizes if size)
+
+    def refresh(self):
+        """
+        сверяет число рецептов и последний updated_at с базой; если они
+        изменились - перечитывает рецепты, сохраненные после прошлой
+        сверки (с запасом MATCH_REFRESH_OVERLAP на долгие транзакции,
+        повторная замена состава безопасна), удаленные - по списку id
+        """
+        state = tuple(Recipe.objects.aggregate(
+            count=Count('id'), updated_at=Max('updated_at')).values())
+        if state == self._state:
+            return
+        with self._lock:
+            if state == self._state:
+                return
+            count, updated_at = state
+            if self._synced_at is None:
+                self._load(RecipeIngredient.objects.order_by(
+                    'recipe_id').values_list('recipe_id', 'ingredient_id')
+                    .iterator(chunk_size=10000))
+            else:
+                since = self._synced_at - timedelta(
+                    seconds=settings.MATCH_REFRESH_OVERLAP)
+                changed = list(Recipe.objects.filter(
+                    updated_at__gte=since).values_list('id', flat=True))
+                items = RecipeIngredient.objects.filter(
+                    recipe__in=changed).values_list('recipe', 'ingredient')
+                ingredients = {recipe_id: [] for recipe_id in changed}
+                for recipe_id, ingredient_id in items:
+                    ingredients[recipe_id].append(ingredient_id)
+                for recipe_id, ingredient_ids in ingredients.items():
+                    self._replace(recipe_id, ingredient_ids)
+                if self._recipes != count:
+                    existing = set(Recipe.objects.values_list(
+                        'id', flat=True))
+                    for recipe_id, size in enumerate(self._sizes):
+                        if size and recipe_id not in existing:
+                            self._replace(recipe_id, ())
+            self._synced_at = updated_at
+            self._state = state
+
+    def _replace(self, recipe_id, ingredient_ids):
+        """ заменяет состав рецепта в индексе, () - удаляет рецепт """
+        bit = 1 << recipe_id
+        if recipe_id < len(self._sizes) and self._sizes[recipe_id]:
+            for ingredient_id, bits in self._bitsets.items():
+                if bits & bit:
+                    self._bitsets[ingredient_id] = bits ^ bit
+            for recipe_ids in self._postings.values():
+                position = bisect.bisect_left(recipe_ids, recipe_id)
+                if (position < len(recipe_ids)
+                        and recipe_ids[position] == recipe_id):
+                    del recipe_ids[position]
+            self._recipes -= 1
+        ingredient_ids = set(ingredient_ids)
+        grow(self._sizes, recipe_id)
+        self._sizes[recipe_id] = len(ingredient_ids)
+        set_counter(self._size_planes, recipe_id, len(ingredient_ids))
+        if not ingredient_ids:
+            return
+        self._recipes += 1
+        for ingredient_id in ingredient_ids:
+            if ingredient_id in self._bitsets:
+                self._bitsets[ingredient_id] |= bit
+            else:
+                bisect.insort(
+                    self._postings.setdefault(ingredient_id, array('I')),
+                    recipe_id)
+
+    def match(self, ingredient_ids, limit, max_missing=None):
+        """
+        [(recipe_id, есть ингредиентов, всего)] рецептов хотя бы с одним
+        ингредиентом из ingredient_ids: сначала с большей долей имеющихся,
+        при равной - с меньшим числом недостающих, затем новые
+        """
+        with self._lock:
+            planes = []
+            for ingredient_id in set(ingredient_ids):
+                bits = self._bitsets.get(ingredient_id)
+                if bits is None:
+                    bits = to_bitset(self._postings.get(ingredient_id, ()))
+                if bits:
+                    add_one(planes, bits)
+            candidates = 0
+            for plane in planes:
+                candidates |= plane
+            if not candidates:
+                return []
+            matched_groups = split(planes, candidates)
+            size_groups = split(self._size_planes, candidates)
+        return take_ranked(matched_groups, size_groups, limit, max_missing)
+
+    def stats(self):
+        with self._lock:
+            pairs = sum(len(ids) for ids in self._postings.values())
+            bitsets = self._bitsets.values()
+            return {
+                'recipes': self._recipes,
+                'ingredients': len(self._bitsets) + len(self._postings),
+                'pairs': pairs + sum(bits.bit_count() for bits in bitsets),
+                'bytes': (
+                    pairs * 4
+                    + sum((bits.bit_length() + 7) // 8
+                          for bits in (*bitsets, *self._size_planes))
+                    + len(self._sizes) * self._sizes.itemsize
+                ),
+            }
+
+
+ingredient_matcher = IngredientMatcher()
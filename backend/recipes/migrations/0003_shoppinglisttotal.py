@@ -0,0 +1,50 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_totals(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListTotal = apps.get_model('recipes', 'ShoppingListTotal')
+    totals = RecipeIngredient.objects.filter(
+        recipe__shoppinglist__isnull=False
+    ).values(
+        'recipe__shoppinglist__user', 'ingredient'
+    ).annotate(total=models.Sum('amount'))
+    ShoppingListTotal.objects.bulk_create(
+        (ShoppingListTotal(user_id=row['recipe__shoppinglist__user'],
+                           ingredient_id=row['ingredient'],
+                           amount=row['total'])
+         for row in totals.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_totals', to='recipes.ingredient')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_totals', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Итог списка покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglisttotal',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_ingredient_in_user_shopping_list_total'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
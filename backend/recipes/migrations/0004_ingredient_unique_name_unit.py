@@ -0,0 +1,63 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:55
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def merge_rows(model, owner, survivor, duplicates):
+    """
+    строки model с ингредиентами-дублями переходят на survivor,
+    количества одного владельца (рецепта, пользователя) складываются
+    """
+    rows = defaultdict(list)
+    for row in model.objects.filter(ingredient__in=[survivor, *duplicates]):
+        rows[getattr(row, f'{owner}_id')].append(row)
+    for owner_rows in rows.values():
+        kept = next((row for row in owner_rows
+                     if row.ingredient_id == survivor), owner_rows[0])
+        model.objects.filter(id__in=[
+            row.id for row in owner_rows if row is not kept]).delete()
+        kept.ingredient_id = survivor
+        kept.amount = sum(row.amount for row in owner_rows)
+        kept.save(update_fields=['ingredient', 'amount'])
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    дубли (name, measurement_unit) сливаются в ингредиент с меньшим id,
+    иначе ограничение уникальности не создать
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    groups = Ingredient.objects.order_by().values(
+        'name', 'measurement_unit'
+    ).annotate(
+        survivor=models.Min('id'), count=models.Count('id')
+    ).filter(count__gt=1)
+    for group in groups:
+        duplicates = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=group['survivor']).values_list('id', flat=True))
+        for model_name, owner in (('RecipeIngredient', 'recipe'),
+                                  ('ShoppingListTotal', 'user')):
+            merge_rows(apps.get_model('recipes', model_name), owner,
+                       group['survivor'], duplicates)
+        Ingredient.objects.filter(id__in=duplicates).delete()
+    if schema_editor.connection.vendor == 'postgresql':
+        # отложенные проверки внешних ключей - до ALTER TABLE ниже
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_shoppinglisttotal'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_name_unit'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_card',
+            field=models.ImageField(blank=True, upload_to='recipes/images/card', verbose_name='Картинка для карточки'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_detail',
+            field=models.ImageField(blank=True, upload_to='recipes/images/detail', verbose_name='Картинка для страницы рецепта'),
+        ),
+    ]
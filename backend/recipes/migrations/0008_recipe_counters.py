@@ -0,0 +1,46 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:17
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def counted(model, field):
+    """ COUNT(*) строк model, ссылающихся полем field на текущую строку """
+    return Coalesce(models.Subquery(
+        model.objects.filter(**{field: models.OuterRef('pk')}).order_by()
+        .values(field).annotate(total=models.Count('pk')).values('total')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+    User = apps.get_model('users', 'User')
+    Recipe.objects.update(
+        favorites_count=counted(Favorite, 'recipe'),
+        cart_count=counted(ShoppingList, 'recipe'),
+    )
+    User.objects.update(recipes_count=counted(Recipe, 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_image_renditions'),
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+def fill_scores(apps, schema_editor):
+    """
+    popularity - по счетчикам, trending - стартовая оценка на момент
+    публикации; уже сделанные добавления в тренды не попадают
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeScore = apps.get_model('recipes', 'RecipeScore')
+    ScoreWatermark = apps.get_model('recipes', 'ScoreWatermark')
+    weights = settings.RECIPE_SCORE_WEIGHTS
+    rate = math.log(2) / (settings.RECIPE_TRENDING_HALF_LIFE * 3600)
+    RecipeScore.objects.bulk_create(
+        (RecipeScore(
+            recipe_id=recipe.id,
+            popularity=(recipe.favorites_count * weights['favorite']
+                        + recipe.cart_count * weights['shopping_cart']),
+            trending=(math.log(weights['created'])
+                      + rate * (recipe.pub_date - EPOCH).total_seconds()),
+        ) for recipe in Recipe.objects.only(
+            'id', 'pub_date', 'favorites_count', 'cart_count').iterator()),
+        batch_size=1000,
+    )
+    for source, model_name in (('favorite', 'Favorite'),
+                               ('shopping_cart', 'ShoppingList')):
+        last_id = apps.get_model('recipes', model_name).objects.aggregate(
+            last_id=models.Max('id'))['last_id']
+        ScoreWatermark.objects.create(source=source, last_id=last_id or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipes.recipe')),
+                ('popularity', models.FloatField(default=0, verbose_name='Популярность')),
+                ('trending', models.FloatField(default=0, verbose_name='Популярность за последнее время')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='дата пересчета')),
+            ],
+            options={
+                'verbose_name': 'Оценка рецепта',
+            },
+        ),
+        migrations.CreateModel(
+            name='ScoreWatermark',
+            fields=[
+                ('source', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Отметка пересчета оценок',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-popularity', '-recipe'], name='recipe_score_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-trending', '-recipe'], name='recipe_score_trending_idx'),
+        ),
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,146 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:24
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# название - вес A, ингредиенты - B, текст - C; русская и английская
+# морфология, чтобы находились оба языка
+SEARCH = (
+    '''
+    CREATE OR REPLACE FUNCTION recipes_search_vector(
+        name text, body text, ingredients text) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('russian', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(ingredients, '')), 'B')
+        || setweight(to_tsvector('english', coalesce(ingredients, '')), 'B')
+        || setweight(to_tsvector('russian', coalesce(body, '')), 'C')
+        || setweight(to_tsvector('english', coalesce(body, '')), 'C')
+    $$ LANGUAGE sql IMMUTABLE
+    ''',
+    '''
+    CREATE OR REPLACE FUNCTION recipes_ingredient_names(recipe bigint)
+    RETURNS text AS $$
+    SELECT string_agg(ingredient.name, ' ')
+    FROM recipes_recipeingredient item
+    JOIN recipes_ingredient ingredient ON ingredient.id = item.ingredient_id
+    WHERE item.recipe_id = recipe
+    $$ LANGUAGE sql STABLE
+    ''',
+    '''
+    CREATE OR REPLACE FUNCTION recipes_recipe_search_trigger()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := recipes_search_vector(
+            NEW.name, NEW.text, recipes_ingredient_names(NEW.id));
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_search
+    BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_trigger()
+    ''',
+    # состав меняется пачкой строк - один пересчет на рецепт за запрос
+    '''
+    CREATE OR REPLACE FUNCTION recipes_recipeingredient_search_trigger()
+    RETURNS trigger AS $$
+    BEGIN
+        UPDATE recipes_recipe SET search_vector = recipes_search_vector(
+            name, text, recipes_ingredient_names(id))
+        WHERE id IN (SELECT recipe_id FROM changed);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipeingredient_search_insert
+    AFTER INSERT ON recipes_recipeingredient
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE recipes_recipeingredient_search_trigger()
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipeingredient_search_update
+    AFTER UPDATE ON recipes_recipeingredient
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE recipes_recipeingredient_search_trigger()
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipeingredient_search_delete
+    AFTER DELETE ON recipes_recipeingredient
+    REFERENCING OLD TABLE AS changed
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE recipes_recipeingredient_search_trigger()
+    ''',
+    '''
+    CREATE OR REPLACE FUNCTION recipes_ingredient_search_trigger()
+    RETURNS trigger AS $$
+    BEGIN
+        UPDATE recipes_recipe SET search_vector = recipes_search_vector(
+            name, text, recipes_ingredient_names(id))
+        WHERE id IN (SELECT recipe_id FROM recipes_recipeingredient
+                     WHERE ingredient_id = NEW.id);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    '''
+    CREATE TRIGGER recipes_ingredient_search
+    AFTER UPDATE OF name ON recipes_ingredient
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE PROCEDURE recipes_ingredient_search_trigger()
+    ''',
+    '''
+    UPDATE recipes_recipe SET search_vector = recipes_search_vector(
+        name, text, recipes_ingredient_names(id))
+    ''',
+    '''
+    CREATE INDEX recipes_recipe_search_vector
+    ON recipes_recipe USING gin (search_vector)
+    ''',
+)
+DROP_SEARCH = (
+    'DROP INDEX IF EXISTS recipes_recipe_search_vector',
+    'DROP TRIGGER IF EXISTS recipes_ingredient_search ON recipes_ingredient',
+    'DROP TRIGGER IF EXISTS recipes_recipeingredient_search_delete '
+    'ON recipes_recipeingredient',
+    'DROP TRIGGER IF EXISTS recipes_recipeingredient_search_update '
+    'ON recipes_recipeingredient',
+    'DROP TRIGGER IF EXISTS recipes_recipeingredient_search_insert '
+    'ON recipes_recipeingredient',
+    'DROP TRIGGER IF EXISTS recipes_recipe_search ON recipes_recipe',
+    'DROP FUNCTION IF EXISTS recipes_ingredient_search_trigger()',
+    'DROP FUNCTION IF EXISTS recipes_recipeingredient_search_trigger()',
+    'DROP FUNCTION IF EXISTS recipes_recipe_search_trigger()',
+    'DROP FUNCTION IF EXISTS recipes_ingredient_names(bigint)',
+    'DROP FUNCTION IF EXISTS recipes_search_vector(text, text, text)',
+)
+
+
+def run_postgresql(statements):
+    """ триггеры и GIN-индекс есть только в PostgreSQL """
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(run_postgresql(SEARCH),
+                             run_postgresql(DROP_SEARCH)),
+    ]
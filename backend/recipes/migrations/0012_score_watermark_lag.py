@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scorewatermark',
+            name='seen_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='scorewatermark',
+            name='seen_id',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
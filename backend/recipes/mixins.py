@@ -1,4 +1,12 @@
+import json
+
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework import mixins, viewsets
+from rest_framework.renderers import JSONRenderer
+
+from .cache import make_etag, response_cache
 
 
 class RetriveAndListViewSet(
@@ -7,3 +15,162 @@ class RetriveAndListViewSet(
     viewsets.GenericViewSet
     ):
     pass
+
+
+def cached_response(request, body, etag):
+    """ готовые json-байты с ETag, 304 при совпадении If-None-Match """
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
+class CachedReferenceMixin:
+    """
+    отдает список и записи справочника из ReferenceCache готовыми
+    json-байтами с ETag, без запросов к БД и сериализации;
+    запросы с параметрами (фильтрами) обрабатываются как обычно
+    """
+    reference_cache = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+        entry = self.reference_cache.get()
+        return cached_response(request, entry.body, entry.etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        if request.query_params:
+            return super().retrieve(request, *args, **kwargs)
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            body, etag = self.reference_cache.get().items[int(lookup)]
+        except (KeyError, ValueError):
+            raise Http404
+        return cached_response(request, body, etag)
+
+
+class SharedResponseCacheMixin:
+    """
+    готовые json-ответы list и retrieve из response_cache, общие для
+    всех пользователей: тело хранится в виде для анонимного, остальным
+    personalize_response подставляет их флаги. Ключ - параметры из
+    response_cache_params (прочие на ответ не влияют), выборки с
+    private_response_params не кэшируются, зависимости ответа для
+    инвалидации возвращает get_response_dependencies
+    """
+    response_cache_params = ()
+    private_response_params = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_or_render(
+            'list', super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_or_render(
+            'retrieve', super().retrieve, request, *args, **kwargs)
+
+    def get_response_dependencies(self, data):
+        return ()
+
+    def personalize_response(self, data, user):
+        return data
+
+    def anonymize_response(self, data):
+        return data
+
+    def is_private_request(self, request):
+        """
+        с параметром из private_response_params при любом значении:
+        BooleanWidget понимает и TRUE, и on, кэш не должен решать иначе
+        """
+        return any(name in request.query_params
+                   for name in self.private_response_params)
+
+    def cached_or_render(self, kind, view, request, *args, **kwargs):
+        self.response_cache_entry = None
+        if (request.accepted_renderer.format != 'json'
+                or self.is_private_request(request)):
+            return view(request, *args, **kwargs)
+        params = [
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+            if name in self.response_cache_params and any(values)
+            and (name, values) != ('page', ['1'])
+        ]
+        params.extend(sorted(kwargs.items()))
+        key = response_cache.key(kind, params)
+        cached = response_cache.get(key)
+        if cached is not None:
+            body, etag = cached
+            if not request.user.is_anonymous:
+                body = JSONRenderer().render(self.personalize_response(
+                    json.loads(body), request.user))
+                etag = make_etag(body)
+            response = cached_response(request, body, etag)
+            patch_vary_headers(response, ('Authorization',))
+            return response
+        epoch = response_cache.epoch()
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            self.response_cache_entry = (
+                key, epoch, self.get_response_dependencies(response.data))
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        entry = getattr(self, 'response_cache_entry', None)
+        if entry is None:
+            return response
+        key, epoch, names = entry
+        response.render()
+        if request.user.is_anonymous:
+            body = response.content
+            etag = response.get('ETag') or make_etag(body)
+        else:
+            body = JSONRenderer().render(
+                self.anonymize_response(response.data))
+            etag = make_etag(body)
+        response_cache.set(key, epoch, body, etag, names)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    отвечает 304 на If-None-Match / If-Modified-Since до выборки и
+    сериализации; валидаторы (etag, last_modified) считают методы
+    list_validators и retrieve_validators, None - без проверки.
+    Стоит в MRO перед SharedResponseCacheMixin: ответ из кэша и новый
+    получают одни и те же ETag и Last-Modified
+    """
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.list_validators(), super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.retrieve_validators(), super().retrieve,
+            request, *args, **kwargs)
+
+    def list_validators(self):
+        return None
+
+    def retrieve_validators(self):
+        return None
+
+    def conditional_response(self, validators, view, request, *args,
+                             **kwargs):
+        if validators is None:
+            return view(request, *args, **kwargs)
+        etag, last_modified = validators
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Authorization',))
+        return response
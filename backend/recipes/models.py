@@ -1,8 +1,14 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Greatest, RowNumber
+from django.db.models.signals import post_save
 from django.utils import timezone
 
+from users.models import Follow
+
 User = get_user_model()
 
 
@@ -45,16 +51,99 @@ class Ingredient(models.Model):
     class Meta:
         ordering = ('name',)
         verbose_name = 'Ингредиент'
+        constraints = [models.UniqueConstraint(
+            fields=['name', 'measurement_unit'],
+            name='unique_ingredient_name_unit')]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    """ выборки рецептов для отображения без лишних запросов """
+
+    def for_display(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipes',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+
+    def previews(self, author_ids, limit=None):
+        """
+        краткие рецепты авторов одним запросом: при limit - не больше
+        limit последних рецептов каждого автора (ROW_NUMBER по автору)
+        """
+        if not author_ids:
+            # пустой IN не собирается в SQL для raw-запроса
+            return []
+        queryset = self.filter(author__in=author_ids).only(
+            'id', 'name', 'image', 'image_card', 'cooking_time', 'author'
+        ).order_by()
+        if limit is None:
+            return queryset.order_by('author', '-id')
+        ranked = queryset.annotate(preview_rank=models.Window(
+            expression=RowNumber(),
+            partition_by=models.F('author'),
+            order_by=models.F('id').desc(),
+        ))
+        sql, params = ranked.query.sql_with_params()
+        return self.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE preview_rank <= %s '
+            'ORDER BY author_id, id DESC',
+            (*params, limit),
+        )
+
+    def ranked(self, score):
+        """
+        по убыванию оценки из RecipeScore (popularity или trending);
+        оценка попадает в выборку под своим именем - по ней же идет
+        keyset-пагинация
+        """
+        return self.filter(score__isnull=False).annotate(
+            **{score: models.F(f'score__{score}')}
+        ).order_by(f'-{score}', '-id')
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            false = models.Value(False, output_field=models.BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                author_is_subscribed=false,
+            )
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingList.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            author_is_subscribed=models.Exists(Follow.objects.filter(
+                user=user, following=models.OuterRef('author'))),
+        )
+
+
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+    """
+    search_vector заполняют триггеры PostgreSQL: он не читается
+    в модели и поэтому не перезаписывается при save()
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
+
 class Recipe(models.Model):
     pub_date = models.DateTimeField(
         verbose_name='дата публикации',
         default=timezone.now,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='дата изменения',
+        auto_now=True,
+        db_index=True,
+    )
     name = models.CharField(
         max_length=200,
         verbose_name='Название',
@@ -85,10 +174,48 @@ class Recipe(models.Model):
         upload_to='recipes/images',
         verbose_name='Картинка'
     )
+    image_card = models.ImageField(
+        upload_to='recipes/images/card',
+        blank=True,
+        verbose_name='Картинка для карточки',
+    )
+    image_detail = models.ImageField(
+        upload_to='recipes/images/detail',
+        blank=True,
+        verbose_name='Картинка для страницы рецепта',
+    )
+
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок',
+    )
+    fanned_out = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name='Разослан в ленты подписчиков',
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+    )
+
+    objects = RecipeManager()
 
     class Meta:
         ordering = ('-id',)
         verbose_name = 'Рецепт'
+        indexes = [
+            # рецепты, которые лента подмешивает при чтении
+            models.Index(fields=['author', '-id'],
+                         condition=models.Q(fanned_out=False),
+                         name='recipe_not_fanned_out_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -121,6 +248,54 @@ class RecipeIngredient(models.Model):
         return 'Ингредиенты'
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    """
+    идемпотентные переключатели избранного и списка покупок, счетчик
+    рецепта (recipe_counter модели) меняется в той же транзакции;
+    post_save и post_delete отправляются, как при save() и delete()
+    """
+
+    def add(self, user, recipe):
+        """
+        одна вставка INSERT ... ON CONFLICT DO NOTHING по уникальной паре
+        (user, recipe); True - запись создана, False - уже была
+        """
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        recipe_id = getattr(recipe, 'pk', recipe)
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, recipe_id) '
+                'VALUES (%s, %s) ON CONFLICT DO NOTHING RETURNING id',
+                [user.id, recipe_id],
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return False
+            self.change_counter(recipe_id, 1)
+            # вставка в обход save(): получатели post_save (итоги списка
+            # покупок) узнают о строке так же, как о созданной в админке
+            post_save.send(
+                sender=self.model, instance=self.model(
+                    id=row[0], user=user, recipe_id=recipe_id),
+                created=True, update_fields=None, raw=False, using=using)
+        return True
+
+    def remove(self, user, recipe):
+        """ один DELETE; True - запись была удалена """
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            deleted, _ = self.filter(user=user, recipe=recipe).delete()
+            if deleted:
+                self.change_counter(getattr(recipe, 'pk', recipe), -1)
+        return bool(deleted)
+
+    def change_counter(self, recipe_id, delta):
+        counter = self.model.recipe_counter
+        Recipe.objects.filter(pk=recipe_id).update(
+            **{counter: Greatest(models.F(counter) + delta, 0)})
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         User,
@@ -133,6 +308,9 @@ class Favorite(models.Model):
         related_name='in_favorite',
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+    recipe_counter = 'favorites_count'
+
     class Meta:
         ordering = ('-id',)
         verbose_name = 'Избранное'
@@ -152,9 +330,246 @@ class ShoppingList(models.Model):
         on_delete=models.CASCADE,
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+    recipe_counter = 'cart_count'
+
     class Meta:
         constraints = [models.UniqueConstraint(
             fields=['user', 'recipe'],
             name='unique_recipe_in_user_shopping_list')]
         ordering = ('-id',)
         verbose_name = 'Список покупок'
+
+
+class ShoppingListTotalQuerySet(models.QuerySet):
+    """ поддержка итогов списка покупок в актуальном состоянии """
+
+    def apply(self, users, deltas):
+        """
+        прибавляет к итогам пользователей users изменения количества
+        {ingredient_id: amount}, отрицательные значения вычитаются
+        """
+        deltas = {key: value for key, value in deltas.items() if value}
+        if not deltas:
+            return
+        with transaction.atomic():
+            user_ids = list(User.objects.select_for_update().filter(
+                id__in=users).order_by('id').values_list('id', flat=True))
+            if not user_ids:
+                return
+            rows = self.filter(user__in=user_ids, ingredient__in=deltas)
+            rows.update(amount=Greatest(models.F('amount') + models.Case(
+                *[models.When(ingredient=key, then=models.Value(value))
+                  for key, value in deltas.items()],
+                default=models.Value(0),
+                output_field=models.IntegerField(),
+            ), 0))
+            existing = set(rows.values_list('user', 'ingredient'))
+            self.bulk_create(
+                ShoppingListTotal(
+                    user_id=user_id, ingredient_id=ingredient_id,
+                    amount=amount)
+                for user_id in user_ids
+                for ingredient_id, amount in deltas.items()
+                if amount > 0 and (user_id, ingredient_id) not in existing
+            )
+            rows.filter(amount__lte=0).delete()
+
+    def add_recipe(self, users, recipe, sign=1):
+        amounts = RecipeIngredient.objects.filter(
+            recipe=recipe).values_list('ingredient', 'amount')
+        self.apply(users, {key: sign * value for key, value in amounts})
+
+    def remove_recipe(self, users, recipe):
+        self.add_recipe(users, recipe, sign=-1)
+
+    def computed(self):
+        """ итоги, посчитанные заново по спискам покупок """
+        return RecipeIngredient.objects.filter(
+            recipe__shoppinglist__isnull=False
+        ).values(
+            'recipe__shoppinglist__user', 'ingredient'
+        ).annotate(total=models.Sum('amount')).values_list(
+            'recipe__shoppinglist__user', 'ingredient', 'total')
+
+
+class ShoppingListTotal(models.Model):
+    """ предрассчитанные итоги списка покупок пользователя """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_totals',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_totals',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество'
+    )
+
+    objects = ShoppingListTotalQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Итог списка покупок'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_ingredient_in_user_shopping_list_total')]
+
+
+class RecipeScore(models.Model):
+    """
+    оценки рецепта для сортировки выдачи, пересчитывает команда
+    update_recipe_scores: popularity - взвешенные счетчики избранного
+    и списков покупок, trending - логарифм суммы весов добавлений,
+    затухающих со временем (см. recipes/scores.py)
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+    )
+    popularity = models.FloatField(
+        default=0,
+        verbose_name='Популярность',
+    )
+    trending = models.FloatField(
+        default=0,
+        verbose_name='Популярность за последнее время',
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='дата пересчета',
+    )
+
+    class Meta:
+        verbose_name = 'Оценка рецепта'
+        indexes = [
+            models.Index(fields=['-popularity', '-recipe'],
+                         name='recipe_score_popular_idx'),
+            models.Index(fields=['-trending', '-recipe'],
+                         name='recipe_score_trending_idx'),
+        ]
+
+
+class ScoreWatermark(models.Model):
+    """
+    последний учтенный в RecipeScore id строки источника; seen_id -
+    наибольший id, видимый в момент seen_at: до него отметка
+    сдвигается, когда все транзакции с меньшими id успели закоммититься
+    """
+    source = models.CharField(
+        max_length=50,
+        primary_key=True,
+    )
+    last_id = models.BigIntegerField(
+        default=0,
+    )
+    seen_id = models.BigIntegerField(
+        default=0,
+    )
+    seen_at = models.DateTimeField(
+        null=True,
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = 'Отметка пересчета оценок'
+
+
+class FeedEntryQuerySet(models.QuerySet):
+    """
+    ленты подписок: рецепт автора, у которого не больше
+    FEED_FANOUT_MAX_FOLLOWERS подписчиков, при публикации записывается
+    во входящие всех подписчиков (fanned_out), рецепты остальных
+    авторов лента подмешивает при чтении
+    """
+
+    def fan_out(self, recipe):
+        """ рассылка нового рецепта; True - рецепт разослан """
+        if User.objects.filter(
+                pk=recipe.author_id,
+                followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+        ).exists():
+            return False
+        followers = Follow.objects.filter(
+            following=recipe.author_id).values_list('user', flat=True)
+        with transaction.atomic():
+            self.bulk_create(
+                (FeedEntry(user_id=user_id, recipe_id=recipe.id,
+                           author_id=recipe.author_id)
+                 for user_id in followers.iterator()),
+                batch_size=1000,
+            )
+            Recipe.objects.filter(pk=recipe.id).update(fanned_out=True)
+        recipe.fanned_out = True
+        return True
+
+    def follow(self, user, author):
+        """ новому подписчику - уже разосланные рецепты автора """
+        recipes = Recipe.objects.filter(
+            author=author, fanned_out=True).values_list('id', flat=True)
+        self.bulk_create(
+            (FeedEntry(user_id=user.id, recipe_id=recipe_id,
+                       author_id=author.id)
+             for recipe_id in recipes.iterator()),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def unfollow(self, user, author_id):
+        self.filter(user=user, author=author_id).delete()
+
+    def recipe_ids(self, user, position=None, reverse=False, limit=None):
+        """
+        id рецептов ленты после position (до нее, если reverse) по
+        убыванию id, не больше limit: столько же берется из входящих
+        и из неразосланных рецептов авторов подписок, затем слияние
+        """
+        inbox = self.filter(user=user).values_list('recipe_id', flat=True)
+        merged = Recipe.objects.filter(
+            fanned_out=False,
+            author__in=Follow.objects.filter(user=user).values('following'),
+        ).values_list('id', flat=True)
+        if position is not None:
+            lookup = 'gt' if reverse else 'lt'
+            inbox = inbox.filter(**{f'recipe_id__{lookup}': position})
+            merged = merged.filter(**{f'id__{lookup}': position})
+        sign = '' if reverse else '-'
+        inbox = inbox.order_by(f'{sign}recipe_id')[:limit]
+        merged = merged.order_by(f'{sign}id')[:limit]
+        return sorted({*inbox, *merged}, reverse=not reverse)[:limit]
+
+
+class FeedEntry(models.Model):
+    """ рецепт во входящих ленты подписок пользователя """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        db_index=False,
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'recipe'],
+            name='unique_recipe_in_user_feed')]
+        indexes = [models.Index(fields=['user', 'author'],
+                                name='feed_entry_user_author_idx')]
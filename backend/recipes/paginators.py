@@ -1,6 +1,181 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+import operator
+from collections import OrderedDict
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (CursorPagination, PageNumberPagination,
+                                       _reverse_ordering)
+from rest_framework.response import Response
 
 
 class CustomPageNumberPaginator(PageNumberPagination):
     """ переопределяет параметр чтобы работал стандартный паджинатор DRF """
     page_size_query_param = 'limit'
+
+
+class KeysetPaginator(CursorPagination):
+    """
+    keyset-пагинация по -id (или по порядку, который задал выборке
+    фильтр, например ?ordering=popular) без OFFSET и COUNT(*): count
+    отдается только по ?count=true, для выборки без фильтров в PostgreSQL -
+    оценка из pg_class.reltuples, иначе null. Позиция курсора - значения
+    всех полей порядка (json, если полей несколько), последнее поле
+    уникально, поэтому повторы оценки не требуют смещения
+    """
+    ordering = '-id'
+    page_size_query_param = 'limit'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset, request)
+        try:
+            return self.paginate_by_position(queryset, request, view)
+        except (ValueError, TypeError, ValidationError):
+            # позиция курсора от другого порядка выборки
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_by_position(self, queryset, request, view):
+        """
+        CursorPagination.paginate_queryset, в котором позиция сравнивается
+        по всем полям порядка: (a, b) < (x, y) - a < x OR (a = x AND b < y)
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(
+                self.position_filter(current_position, reverse))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering)
+        else:
+            following_position = None
+        has_current = current_position is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = (
+                has_current, following_position is not None)
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next, self.has_previous = (
+                following_position is not None, has_current)
+            self.next_position = following_position
+            self.previous_position = current_position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def position_filter(self, position, reverse):
+        values = (json.loads(position) if len(self.ordering) > 1
+                  else [position])
+        if len(values) != len(self.ordering):
+            raise ValueError(position)
+        conditions, equal = [], {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') != reverse else 'gt'
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': value}))
+            equal[name] = value
+        return reduce(operator.or_, conditions)
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [getattr(instance, field.lstrip('-')) for field in ordering]
+        if len(values) == 1:
+            return str(values[0])
+        return json.dumps(values)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = queryset.query.order_by
+        if ordering and all(isinstance(field, str) for field in ordering):
+            return tuple(ordering)
+        return super().get_ordering(request, queryset, view)
+
+    def get_count(self, queryset, request):
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            return queryset.count()
+        connection = connections[queryset.db]
+        if (connection.vendor != 'postgresql'
+                or queryset.query.has_filters()):
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return max(row[0], 0) if row else None
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class FeedPaginator(KeysetPaginator):
+    """
+    keyset-пагинация выборки, которую нельзя отдать одним запросом:
+    ее сужают до id страницы из view.get_page_ids(position, reverse,
+    limit), дальше - обычная пагинация по курсору; count не считается
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            position, reverse, offset = None, False, 0
+        else:
+            position, reverse, offset = (
+                cursor.position, cursor.reverse, cursor.offset)
+        ids = view.get_page_ids(position, reverse, offset + page_size + 1)
+        return super().paginate_queryset(
+            queryset.filter(id__in=ids), request, view)
+
+    def get_count(self, queryset, request):
+        return None
+
+
+class CursorOrPageNumberPaginator(CustomPageNumberPaginator):
+    """ постраничная пагинация, с параметром ?cursor= - keyset по -id """
+    cursor_paginator_class = KeysetPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        cursor_param = self.cursor_paginator_class.cursor_query_param
+        if cursor_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_paginator = self.cursor_paginator_class()
+        return self.cursor_paginator.paginate_queryset(
+            queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_html_context()
+        return super().get_html_context()
@@ -0,0 +1,70 @@
+import abc
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class Echo:
+    """ псевдо-буфер: csv.writer возвращает строку вместо записи в файл """
+    def write(self, value):
+        return value
+
+
+class ShoppingCartRenderer(abc.ABC, BaseRenderer):
+    """
+    базовый рендерер списка покупок: формат выбирается через ?format=,
+    строки отдаются генератором для StreamingHttpResponse
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """ обычным рендерингом сюда приходят только ответы с ошибками """
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    @abc.abstractmethod
+    def stream(self, rows):
+        """ строки файла по (name, measurement_unit, amount) """
+
+    @property
+    def content_type(self):
+        return f'{self.media_type}; charset={self.charset}'
+
+    @property
+    def filename(self):
+        return f'shopping_list.{self.format}'
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        yield 'Список покупок:\n\n'
+        for number, (name, unit, amount) in enumerate(rows, start=1):
+            yield f'{number}) {name} - {amount} {unit}\n'
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('name', 'measurement_unit', 'amount'))
+        for row in rows:
+            yield writer.writerow(row)
+
+
+class ShoppingCartJSONRenderer(ShoppingCartRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, rows):
+        separator = '['
+        for name, unit, amount in rows:
+            yield separator + json.dumps(
+                {'name': name, 'measurement_unit': unit, 'amount': amount},
+                ensure_ascii=False)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
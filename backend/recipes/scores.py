@@ -0,0 +1,135 @@
+import math
+from collections import Counter
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from .cache import response_cache
+from .models import (Favorite, Recipe, RecipeScore, ScoreWatermark,
+                     ShoppingList)
+
+# источники добавлений: имя отметки (и веса) -> модель
+SOURCES = {
+    'favorite': Favorite,
+    'shopping_cart': ShoppingList,
+}
+# от этого момента отсчитывается время в trending
+EPOCH = datetime(2021, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def trending_points(weight, when):
+    """
+    вклад добавления с весом weight в момент when в логарифмической шкале:
+    log(weight * 2^((when - EPOCH) / half_life)). Вместо того чтобы
+    уменьшать со временем все оценки, более поздние добавления весят
+    больше, поэтому порядок по trending не зависит от текущего времени
+    и хранимые оценки не надо пересчитывать
+    """
+    half_life = settings.RECIPE_TRENDING_HALF_LIFE * 3600
+    age = (when - EPOCH).total_seconds()
+    return math.log(weight) + age * math.log(2) / half_life
+
+
+def log_add(first, second):
+    """ log(e^first + e^second) без переполнения """
+    high, low = max(first, second), min(first, second)
+    return high + math.log1p(math.exp(low - high))
+
+
+def popularity():
+    weights = settings.RECIPE_SCORE_WEIGHTS
+    return models.ExpressionWrapper(
+        models.F('favorites_count') * weights['favorite']
+        + models.F('cart_count') * weights['shopping_cart'],
+        output_field=models.FloatField(),
+    )
+
+
+def initial_score(recipe):
+    return RecipeScore(
+        recipe_id=recipe.id,
+        trending=trending_points(
+            settings.RECIPE_SCORE_WEIGHTS['created'], recipe.pub_date),
+    )
+
+
+def update_scores(full=False, batch_size=1000):
+    """
+    учитывает строки Favorite и ShoppingList, добавленные после отметок
+    ScoreWatermark: их вклад в trending считается на момент запуска,
+    popularity затронутых рецептов берется из счетчиков. Строка с
+    меньшим id может закоммититься позже строки с большим, поэтому
+    учитываются только id, видимые при запуске не меньше
+    RECIPE_SCORE_COMMIT_LAG секунд назад. full - еще и popularity всех
+    рецептов (удаления из избранного отметки не видят).
+    Возвращает (число новых строк по источникам, число рецептов)
+    """
+    now = timezone.now()
+    lag = timedelta(seconds=settings.RECIPE_SCORE_COMMIT_LAG)
+    weights = settings.RECIPE_SCORE_WEIGHTS
+    with transaction.atomic():
+        # блокировка отметок не дает двум запускам учесть строки дважды
+        marks = {
+            source: ScoreWatermark.objects.select_for_update().get_or_create(
+                source=source)[0]
+            for source in SOURCES
+        }
+        added = Counter()
+        new_rows = {}
+        for source, model in SOURCES.items():
+            mark = marks[source]
+            rows = model.objects.filter(id__gt=mark.last_id).order_by()
+            new_rows[source] = 0
+            if mark.seen_at is not None and now - mark.seen_at >= lag:
+                counts = rows.filter(id__lte=mark.seen_id).values(
+                    'recipe').annotate(total=models.Count('id'))
+                for row in counts:
+                    added[row['recipe']] += row['total'] * weights[source]
+                    new_rows[source] += row['total']
+                mark.last_id = max(mark.last_id, mark.seen_id)
+                mark.seen_at = None
+            if mark.seen_at is None:
+                seen_id = rows.aggregate(seen_id=models.Max('id'))['seen_id']
+                mark.seen_id = max(seen_id or 0, mark.last_id)
+                mark.seen_at = now
+            mark.save()
+
+        recipes = Recipe.objects.filter(id__in=added).annotate(
+            popularity=popularity()).only('id', 'pub_date')
+        scores = RecipeScore.objects.in_bulk(added.keys())
+        changed, created = [], []
+        for recipe in recipes:
+            score = scores.get(recipe.id)
+            if score is None:
+                score = initial_score(recipe)
+                created.append(score)
+            else:
+                changed.append(score)
+            score.popularity = recipe.popularity
+            score.trending = log_add(
+                score.trending, trending_points(added[recipe.id], now))
+            score.updated_at = now
+        RecipeScore.objects.bulk_update(
+            changed, ['popularity', 'trending', 'updated_at'],
+            batch_size=batch_size)
+        RecipeScore.objects.bulk_create(created, batch_size=batch_size)
+        changed += created
+
+        if full:
+            RecipeScore.objects.bulk_create(
+                (initial_score(recipe) for recipe in Recipe.objects.filter(
+                    score__isnull=True).only('id', 'pub_date').iterator()),
+                batch_size=batch_size,
+            )
+            RecipeScore.objects.update(
+                popularity=models.Subquery(Recipe.objects.filter(
+                    pk=models.OuterRef('recipe')
+                ).annotate(popularity=popularity()).values('popularity')),
+                updated_at=now,
+            )
+        if changed or full:
+            response_cache.invalidate('scores')
+    return new_rows, len(changed)
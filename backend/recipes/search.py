@@ -0,0 +1,129 @@
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+from django.db.models import Count, Max
+
+from .cache import ingredients_cache
+from .models import Ingredient, Recipe, RecipeIngredient
+
+
+class IngredientPrefixIndex:
+    """
+    отсортированный массив названий ингредиентов в памяти процесса:
+    поиск по префиксу для баз без триграммных индексов (sqlite),
+    пересобирается при смене версии справочника ингредиентов
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = None
+
+    def _get_data(self):
+        version = ingredients_cache.version()
+        if self._version == version:
+            return self._data
+        with self._lock:
+            if self._version != version:
+                rows = sorted(
+                    (name.lower(), pk) for pk, name
+                    in Ingredient.objects.values_list('id', 'name')
+                )
+                self._data = ([key for key, _ in rows],
+                              [pk for _, pk in rows])
+                self._version = version
+        return self._data
+
+    def search(self, query, limit, contains=True):
+        """ id: сначала совпавшие по префиксу, потом по вхождению """
+        keys, ids = self._get_data()
+        query = query.lower()
+        found = []
+        position = bisect.bisect_left(keys, query)
+        while (position < len(keys) and len(found) < limit
+               and keys[position].startswith(query)):
+            found.append(ids[position])
+            position += 1
+        if contains and len(found) < limit:
+            prefix_found = set(found)
+            for key, pk in zip(keys, ids):
+                if query in key and pk not in prefix_found:
+                    found.append(pk)
+                    if len(found) >= limit:
+                        break
+        return found
+
+
+ingredient_index = IngredientPrefixIndex()
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower().replace('ё', 'е'))
+
+
+class RecipeSearchIndex:
+    """
+    инвертированный индекс рецептов в памяти процесса для ?search= на
+    базах без полнотекстового поиска (sqlite): слово -> {id: вес}, веса
+    полей как у ts_rank по умолчанию (название 1.0, ингредиенты 0.4,
+    текст 0.2). Слова запроса ищутся по префиксу вместо морфологии и
+    должны найтись все. Пересобирается, когда меняются рецепты (число,
+    последний updated_at) или справочник ингредиентов
+    """
+    weights = (('name', 1.0), ('ingredients', 0.4), ('text', 0.2))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._data = None
+
+    def _get_data(self):
+        state = (ingredients_cache.version(), *Recipe.objects.aggregate(
+            count=Count('id'), updated_at=Max('updated_at')).values())
+        if self._state == state:
+            return self._data
+        with self._lock:
+            if self._state != state:
+                self._data = self._build()
+                self._state = state
+        return self._data
+
+    def _build(self):
+        fields = defaultdict(dict)
+        for pk, name, text in Recipe.objects.values_list(
+                'id', 'name', 'text'):
+            fields[pk].update(name=name, text=text)
+        for pk, name in RecipeIngredient.objects.values_list(
+                'recipe', 'ingredient__name'):
+            fields[pk]['ingredients'] = (
+                fields[pk].get('ingredients', '') + ' ' + name)
+        postings = defaultdict(lambda: defaultdict(float))
+        for pk, values in fields.items():
+            for field, weight in self.weights:
+                for word in tokenize(values.get(field, '')):
+                    postings[word][pk] += weight
+        return sorted(postings), postings
+
+    def search(self, query, limit):
+        """ [(id, вес)] по убыванию веса, не больше limit """
+        words, postings = self._get_data()
+        found = None
+        for term in set(tokenize(query)):
+            matched = defaultdict(float)
+            position = bisect.bisect_left(words, term)
+            while (position < len(words)
+                   and words[position].startswith(term)):
+                for pk, weight in postings[words[position]].items():
+                    matched[pk] += weight
+                position += 1
+            if found is None:
+                found = matched
+            else:
+                found = {pk: found[pk] + weight
+                         for pk, weight in matched.items() if pk in found}
+        return sorted((found or {}).items(),
+                      key=lambda item: (-item[1], -item[0]))[:limit]
+
+
+recipe_index = RecipeSearchIndex()
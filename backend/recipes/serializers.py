@@ -1,12 +1,14 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import F
-from drf_extra_fields.fields import Base64ImageField
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
 
 from users.serializers import CustomUserSerializer
+from .fields import RecipeImageField, StreamingBase64ImageField
+from .images import schedule_renditions
 from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingList, Tag)
+                     ShoppingList, ShoppingListTotal, Tag)
 
 User = get_user_model()
 
@@ -53,6 +55,8 @@ class ShowRecipeIngredientSerializer(serializers.ModelSerializer):
 
 class ShowRecipeSerializer(serializers.ModelSerializer):
     """ сериалайзер для сокращенного просмотра рецепта """
+    image = RecipeImageField('image_card')
+
     class Meta:
         model = Recipe
         fields = (
@@ -67,6 +71,7 @@ class ShowRecipeFullSerializer(serializers.ModelSerializer):
     """ сериалайзер для полного просмотра рецепта +методы """
     tags = TagSerializer(many=True, read_only=True)
     author = CustomUserSerializer(read_only=True)
+    image = RecipeImageField('image_detail')
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
@@ -86,17 +91,26 @@ class ShowRecipeFullSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
         )
 
+    def to_representation(self, obj):
+        if hasattr(obj, 'author_is_subscribed'):
+            obj.author.is_subscribed = obj.author_is_subscribed
+        return super().to_representation(obj)
+
     def get_ingredients(self, obj):
-        ingredients = RecipeIngredient.objects.filter(recipe=obj)
-        return ShowRecipeIngredientSerializer(ingredients, many=True).data
+        return ShowRecipeIngredientSerializer(
+            obj.recipes.all(), many=True).data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
         return Favorite.objects.filter(recipe=obj, user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -106,9 +120,18 @@ class ShowRecipeFullSerializer(serializers.ModelSerializer):
         ).exists()
 
 
+class MatchedRecipeSerializer(ShowRecipeFullSerializer):
+    """ рецепт в подборе по ингредиентам: сколько есть и сколько докупить """
+    matched = serializers.IntegerField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(ShowRecipeFullSerializer.Meta):
+        fields = ShowRecipeFullSerializer.Meta.fields + ('matched', 'missing')
+
+
 class AddRecipeIngredientSerializer(serializers.ModelSerializer):
     """ сериалайзер для добавления ингредиента и количества в рецепт """
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -118,7 +141,7 @@ class AddRecipeIngredientSerializer(serializers.ModelSerializer):
 
 class AddRecipeSerializer(serializers.ModelSerializer):
     """ сериалайзер для добавления рецепта +валидаторы """
-    image = Base64ImageField()
+    image = StreamingBase64ImageField()
     author = CustomUserSerializer(read_only=True)
     ingredients = AddRecipeIngredientSerializer(many=True)
     tags = serializers.PrimaryKeyRelatedField(
@@ -141,27 +164,27 @@ class AddRecipeSerializer(serializers.ModelSerializer):
         )
 
     def validate_ingredients(self, data):
-        ingredients = self.initial_data.get('ingredients')
-        if not ingredients:
+        if not data:
             raise ValidationError('Добавьте ингредиент')
-        for ingredient in ingredients:
-            if int(ingredient['amount']) <= 0:
+        for ingredient in data:
+            if ingredient['amount'] <= 0:
                 raise ValidationError('Не может быть отрицательным')
-        ingredients_count = len(ingredients)
-        ingredients_set = len(set([i['id'] for i in ingredients]))
-        if ingredients_count > ingredients_set:
+        ingredient_ids = {ingredient['id'] for ingredient in data}
+        if len(data) > len(ingredient_ids):
             raise ValidationError('Ингредиенты повторяются')
+        found = set(Ingredient.objects.filter(
+            id__in=ingredient_ids).values_list('id', flat=True))
+        missing = ingredient_ids - found
+        if missing:
+            raise ValidationError(
+                f'Ингредиенты не найдены: {sorted(missing)}')
         return data
 
     def validate_tags(self, data):
-        tags = self.initial_data.get('tags')
-        if len(tags) == 0:
+        if len(data) == 0:
             raise serializers.ValidationError('Добавьте тег')
-        unique_tags = set()
-        for item in tags:
-            if item in unique_tags:
-                raise serializers.ValidationError('Теги повторяются')
-            unique_tags.add(item)
+        if len(data) > len(set(data)):
+            raise serializers.ValidationError('Теги повторяются')
         return data
 
     def validate_cooking_time(self, data):
@@ -169,32 +192,69 @@ class AddRecipeSerializer(serializers.ModelSerializer):
             raise ValidationError('Не может быть меньше 1')
         return data
 
-    def add_recipe_ingredients(self, ingredients, recipe):
-        for ingredient in ingredients:
-            ingredient_id = ingredient['id']
-            amount = ingredient['amount']
-            if (RecipeIngredient.objects.
-                    filter(recipe=recipe, ingredient=ingredient_id).exists()):
-                amount += F('amount')
-            RecipeIngredient.objects.update_or_create(
-                recipe=recipe, ingredient=ingredient_id,
-                defaults={'amount': amount})
+    def set_recipe_ingredients(self, recipe, ingredients):
+        """
+        приводит ингредиенты рецепта к ingredients одним удалением,
+        одной массовой вставкой и одним массовым обновлением,
+        возвращает изменения количества {ingredient_id: amount} от
+        вставки и обновления: их сигналы не отправляются, удаленные
+        строки вычитает из итогов post_delete
+        """
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        existing = {row.ingredient_id: row for row in recipe.recipes.all()}
+        deltas = {
+            ingredient_id: amount - getattr(existing.get(ingredient_id),
+                                            'amount', 0)
+            for ingredient_id, amount in amounts.items()
+        }
+        removed = [row for ingredient_id, row in existing.items()
+                   if ingredient_id not in amounts]
+        changed = []
+        for ingredient_id, row in existing.items():
+            if ingredient_id in amounts and row.amount != amounts[
+                    ingredient_id]:
+                row.amount = amounts[ingredient_id]
+                changed.append(row)
+        if removed:
+            RecipeIngredient.objects.filter(
+                id__in=[row.id for row in removed]).delete()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        )
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        return deltas
 
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context.get('request').user
         tags_data = validated_data.pop('tags')
         ingredients_data = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(author=author, **validated_data)
-        self.add_recipe_ingredients(ingredients_data, recipe)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=item['id'],
+                             amount=item['amount'])
+            for item in ingredients_data
+        )
         recipe.tags.set(tags_data)
+        schedule_renditions(recipe.id)
         return recipe
 
+    @transaction.atomic
     def update(self, recipe, validated_data):
-        if 'ingredients' in self.initial_data:
-            ingredients = validated_data.pop('ingredients')
-            recipe.ingredients.clear()
-            self.add_recipe_ingredients(ingredients, recipe)
-        if 'tags' in self.initial_data:
+        if 'image' in validated_data:
+            for field_name in settings.RECIPE_IMAGE_RENDITIONS:
+                validated_data[field_name] = ''
+            schedule_renditions(recipe.id)
+        if 'ingredients' in validated_data:
+            deltas = self.set_recipe_ingredients(
+                recipe, validated_data.pop('ingredients'))
+            ShoppingListTotal.objects.apply(
+                recipe.shoppinglist_set.values('user'), deltas)
+        if 'tags' in validated_data:
             tags_data = validated_data.pop('tags')
             recipe.tags.set(tags_data)
         super().update(recipe, validated_data)
@@ -204,54 +264,3 @@ class AddRecipeSerializer(serializers.ModelSerializer):
         data = ShowRecipeSerializer(
             recipe, context={'request': self.context.get('request')}).data
         return data
-
-
-class FavouriteSerializer(serializers.ModelSerializer):
-    """ сериалайзер избранного +валидатор """
-    recipe = serializers.PrimaryKeyRelatedField(queryset=Recipe.objects.all())
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
-
-    class Meta:
-        model = Favorite
-        fields = (
-            'user',
-            'recipe',
-        )
-
-    def validate(self, data):
-        user = data['user']
-        recipe_id = data['recipe'].id
-        if Favorite.objects.filter(user=user, recipe__id=recipe_id).exists():
-            raise ValidationError('Уже в избранном')
-        return data
-
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        context = {'request': request}
-        return ShowRecipeSerializer(instance.recipe, context=context).data
-
-
-class ShoppingListSerializer(serializers.ModelSerializer):
-    """ сериалайзер списка покупок +валидатор """
-    recipe = serializers.PrimaryKeyRelatedField(queryset=Recipe.objects.all())
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
-
-    class Meta:
-        model = ShoppingList
-        fields = (
-            'user',
-            'recipe',
-        )
-
-    def validate(self, data):
-        user = data['user']
-        recipe_id = data['recipe'].id
-        if ShoppingList.objects.filter(user=user,
-                                       recipe__id=recipe_id).exists():
-            raise ValidationError('уже в списке')
-        return data
-
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        context = {'request': request}
-        return ShowRecipeSerializer(instance.recipe, context=context).data
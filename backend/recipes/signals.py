@@ -0,0 +1,158 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from .cache import (ingredients_cache, response_cache, tags_cache,
+                    touch_profile)
+from .models import (FeedEntry, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingList, ShoppingListTotal, Tag)
+from .scores import initial_score
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    ingredients_cache.invalidate()
+    response_cache.invalidate('ingredients')
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(**kwargs):
+    tags_cache.invalidate()
+    response_cache.invalidate('tags')
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe(instance, created, **kwargs):
+    """ от текста любого рецепта зависит и выдача поиска """
+    names = [f'recipe:{instance.id}', 'search']
+    if created:
+        names += ['recipes', f'author-recipes:{instance.author_id}']
+    response_cache.invalidate(*names)
+
+
+@receiver(post_save, sender=Recipe)
+def count_created_recipe(instance, created, **kwargs):
+    """ счетчик рецептов автора - в транзакции сохранения рецепта """
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(instance, created, **kwargs):
+    """ новый рецепт сразу попадает в выдачу по оценкам """
+    if created:
+        initial_score(instance).save(force_insert=True)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(instance, created, **kwargs):
+    if created:
+        FeedEntry.objects.fan_out(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=Greatest(F('recipes_count') - 1, 0))
+
+
+@receiver(pre_delete, sender=Recipe)
+def invalidate_deleted_recipe(instance, **kwargs):
+    response_cache.invalidate(
+        f'recipe:{instance.id}', 'recipes',
+        f'author-recipes:{instance.author_id}',
+        *(f'tag:{slug}'
+          for slug in instance.tags.values_list('slug', flat=True)))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    """ рецепт появился в выдаче по тегу или пропал из нее """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        recipes = pk_set or instance.tags.values_list('id', flat=True)
+        slugs = [instance.slug]
+    else:
+        recipes = [instance.id]
+        tags = (Tag.objects.filter(id__in=pk_set) if pk_set
+                else instance.tags.all())
+        slugs = tags.values_list('slug', flat=True)
+    response_cache.invalidate(
+        *(f'recipe:{recipe}' for recipe in recipes),
+        *(f'tag:{slug}' for slug in slugs))
+
+
+@receiver(pre_save, sender=ShoppingList)
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_saved_row(sender, instance, **kwargs):
+    """ прежняя строка - post_save вычтет ее из итогов списков покупок """
+    instance.saved_row = None
+    if not instance._state.adding:
+        instance.saved_row = sender.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=ShoppingList)
+def count_shopping_list(instance, **kwargs):
+    """
+    итоги списка покупок - в транзакции изменения списка: и из ручек,
+    и из админки
+    """
+    saved = getattr(instance, 'saved_row', None)
+    if saved is not None:
+        if (saved.user_id, saved.recipe_id) == (
+                instance.user_id, instance.recipe_id):
+            return
+        ShoppingListTotal.objects.remove_recipe(
+            [saved.user_id], saved.recipe_id)
+    ShoppingListTotal.objects.add_recipe(
+        [instance.user_id], instance.recipe_id)
+
+
+@receiver(post_delete, sender=ShoppingList)
+def uncount_shopping_list(instance, **kwargs):
+    """
+    при удалении рецепта каскадом строки списков и ингредиентов
+    удаляются по очереди: рецепт вычитает из итогов та модель, что
+    удалена первой, для второй уже нечего вычитать
+    """
+    ShoppingListTotal.objects.remove_recipe(
+        [instance.user_id], instance.recipe_id)
+
+
+def change_recipe_amount(recipe_id, ingredient_id, amount):
+    ShoppingListTotal.objects.apply(
+        ShoppingList.objects.filter(recipe=recipe_id).values('user'),
+        {ingredient_id: amount})
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def count_recipe_ingredient(instance, **kwargs):
+    """ ингредиенты, добавленные или измененные поштучно (админка) """
+    saved = getattr(instance, 'saved_row', None)
+    if saved is not None:
+        change_recipe_amount(saved.recipe_id, saved.ingredient_id,
+                             -saved.amount)
+    change_recipe_amount(instance.recipe_id, instance.ingredient_id,
+                         instance.amount)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def uncount_recipe_ingredient(instance, **kwargs):
+    change_recipe_amount(instance.recipe_id, instance.ingredient_id,
+                         -instance.amount)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(instance, update_fields=None, **kwargs):
+    """ вход пользователя меняет только last_login - ответы не зависят """
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    response_cache.invalidate(f'author:{instance.id}')
+    touch_profile(instance.id)
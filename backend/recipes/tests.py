@@ -0,0 +1,696 @@
+import json
+import random
+import tempfile
+from io import StringIO
+from itertools import combinations
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from users.models import User
+from .cache import USER_FLAGS_KEY, user_flags
+from .filters import RecipeFilter
+from .matching import IngredientMatcher
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     RecipeScore, ShoppingList, ShoppingListTotal, Tag)
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com', password='pass',
+        first_name='Имя', last_name='Фамилия')
+
+
+def authorize(client, user):
+    token, _ = Token.objects.get_or_create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+
+def clear_caches():
+    cache.clear()
+    caches['responses'].clear()
+
+
+class RecipeListQueriesTest(APITestCase):
+    """ число запросов списка рецептов не зависит от размера страницы """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass',
+            first_name='Имя', last_name='Фамилия')
+        tags = [
+            Tag.objects.create(name=f'Тег {number}',
+                               color=f'#00000{number}', slug=f'tag{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        for number in range(60):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipes/image.png')
+            recipe.tags.set(tags[:number % 3 + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=number + 1)
+                for ingredient in ingredients[:number % 5 + 1])
+
+    def setUp(self):
+        # готовые ответы и версии из кэша не должны сократить выборку
+        cache.clear()
+        caches['responses'].clear()
+
+    def assert_list_queries(self, count):
+        for limit in (6, 50):
+            with self.subTest(limit=limit), self.assertNumQueries(count):
+                response = self.client.get(f'/api/recipes/?limit={limit}')
+                self.assertEqual(len(response.data['results']), limit)
+            cache.clear()
+            caches['responses'].clear()
+
+    def test_anonymous_list(self):
+        self.assert_list_queries(5)
+
+    def test_authenticated_list(self):
+        token = Token.objects.create(user=self.author)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assert_list_queries(6)
+
+
+class RecipeFilterPlanTest(TestCase):
+    """
+    каждый фильтр рецептов и их сочетания читают свою таблицу по индексу:
+    в плане нет полного просмотра таблиц тегов, избранного и покупок
+    """
+    tables = {
+        'tags': 'recipes_recipe_tags',
+        'is_favorited': 'recipes_favorite',
+        'is_in_shopping_cart': 'recipes_shoppinglist',
+    }
+    params = {'tags': 'breakfast', 'is_favorited': '1',
+              'is_in_shopping_cart': '1'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass',
+            first_name='Имя', last_name='Фамилия')
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+
+    def explain(self, names):
+        request = RequestFactory().get(
+            '/api/recipes/', {name: self.params[name] for name in names})
+        request.user = self.user
+        queryset = RecipeFilter(
+            request.GET, queryset=Recipe.objects.order_by('-id'),
+            request=request).qs
+        if connection.vendor != 'postgresql':
+            return queryset.explain()
+        # на почти пустых таблицах PostgreSQL и так выберет Seq Scan
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+
+    def test_filters_use_indexes(self):
+        for count in range(1, len(self.params) + 1):
+            for names in combinations(self.params, count):
+                with self.subTest(filters=names):
+                    plan = self.explain(names)
+                    for name in names:
+                        table = self.tables[name]
+                        if connection.vendor == 'postgresql':
+                            self.assertIn(table, plan)
+                            self.assertNotRegex(
+                                plan, rf'Seq Scan on {table}\b')
+                        else:
+                            self.assertRegex(
+                                plan,
+                                rf'SEARCH \w+ USING (COVERING )?INDEX '
+                                rf'\w*{table}')
+                    self.assertNotIn('DISTINCT', plan.upper())
+
+
+class SharedResponseCacheTest(APITestCase):
+    """ общий кэш ответов: флаги пользователя не достаются другим """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = create_user('alice')
+        cls.bob = create_user('bob')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.bob, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipes/image.png')
+            for number in range(3)
+        ]
+        Favorite.objects.create(user=cls.alice, recipe=cls.recipes[0])
+
+    def setUp(self):
+        clear_caches()
+
+    def get(self, url, user=None):
+        client = self.client_class()
+        if user is not None:
+            authorize(client, user)
+        return client.get(url)
+
+    def test_private_filter_in_any_case_is_not_shared(self):
+        for value in ('TRUE', 'True', 'true', '1'):
+            clear_caches()
+            with self.subTest(value=value):
+                url = f'/api/recipes/?is_favorited={value}'
+                self.assertEqual(self.get(url, self.alice).data['count'], 1)
+                self.assertEqual(self.get(url).data['count'], 0)
+                self.assertEqual(self.get(url, self.bob).data['count'], 0)
+
+    def test_cached_list_is_personalized(self):
+        anonymous = self.get('/api/recipes/')
+        self.assertFalse(any(item['is_favorited']
+                             for item in anonymous.data['results']))
+        for user, favorited in ((self.alice, {self.recipes[0].id}),
+                                (self.bob, set())):
+            with self.subTest(user=user.username):
+                response = self.get('/api/recipes/', user)
+                self.assertEqual(
+                    {item['id'] for item in response.json()['results']
+                     if item['is_favorited']},
+                    favorited)
+
+    def test_changes_invalidate_cached_responses(self):
+        recipe = self.recipes[1]
+        urls = ('/api/recipes/', f'/api/recipes/{recipe.id}/',
+                f'/api/recipes/?author={self.bob.id}')
+        for url in urls:
+            self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = 'Новое название'
+            recipe.save()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertIn('Новое название', self.get(url).content.decode())
+        client = self.client_class()
+        authorize(client, self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.get(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertTrue(self.get(urls[1], self.bob).json()['is_favorited'])
+        self.assertFalse(
+            self.get(urls[1], self.alice).json()['is_favorited'])
+        self.assertFalse(self.get(urls[1]).json()['is_favorited'])
+
+
+class ConditionalGetTest(APITestCase):
+    """
+    ETag и Last-Modified не зависят от того, взят ли ответ из общего
+    кэша; изменение рецепта, флагов или автора дает новый ETag
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.author = create_user('author')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Текст', cooking_time=10,
+            image='recipes/image.png')
+
+    def setUp(self):
+        clear_caches()
+
+    def assert_validators_survive_cache(self, url):
+        first = self.client.get(url)
+        cached = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(cached['ETag'], first['ETag'])
+        self.assertEqual(cached['Last-Modified'], first['Last-Modified'])
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']
+        ).status_code, 304)
+        return first['ETag']
+
+    def test_anonymous(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.id}/'):
+            with self.subTest(url=url):
+                self.assert_validators_survive_cache(url)
+
+    def test_authenticated(self):
+        authorize(self.client, self.user)
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.id}/'):
+            with self.subTest(url=url):
+                self.assert_validators_survive_cache(url)
+
+    def test_changes_give_new_etag(self):
+        authorize(self.client, self.user)
+        url = f'/api/recipes/{self.recipe.id}/'
+        etag = self.assert_validators_survive_cache(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(
+                self.client.get(f'{url}favorite/').status_code, 201)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_favorited'])
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Новое имя'
+            self.author.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['author']['first_name'],
+                         'Новое имя')
+
+    def test_list_follows_recipes_and_profiles(self):
+        url = '/api/recipes/'
+        etag = self.assert_validators_survive_cache(url)
+        # вход пользователя меняет только last_login
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.client.login(
+                email='author@example.com', password='pass'))
+        self.client.logout()
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.last_name = 'Новая фамилия'
+            self.author.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(
+                author=self.author, name='Новый', text='Текст',
+                cooking_time=5, image='recipes/image.png')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_missing_recipe(self):
+        for url in ('/api/recipes/0/', '/api/recipes/abc/'):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH='"x"')
+                self.assertEqual(response.status_code, 404)
+                self.assertNotIn('ETag', response)
+
+
+class UserFlagsCacheTest(APITestCase):
+    """
+    флаги пользователя в кэше сбрасываются после коммита изменения,
+    ни одно из подряд идущих изменений не теряется
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.author = create_user('author')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipes/image.png')
+            for number in range(2)
+        ]
+
+    def setUp(self):
+        clear_caches()
+        authorize(self.client, self.user)
+
+    def change(self, method, url, status_code):
+        user_flags.get(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url)
+        self.assertEqual(response.status_code, status_code)
+        self.assertIsNone(cache.get(USER_FLAGS_KEY.format(self.user.id)))
+
+    def test_changes_reach_flags(self):
+        first, second = (f'/api/recipes/{recipe.id}/'
+                         for recipe in self.recipes)
+        self.change('get', f'{first}favorite/', 201)
+        self.change('get', f'{second}shopping_cart/', 201)
+        self.change('get', f'/api/users/{self.author.id}/subscribe/', 201)
+        self.assertEqual(user_flags.get(self.user), user_flags.load(self.user))
+        response = self.client.get(second).json()
+        self.assertTrue(response['is_in_shopping_cart'])
+        self.assertTrue(response['author']['is_subscribed'])
+        self.change('delete', f'{first}favorite/', 204)
+        self.change('delete', f'/api/users/{self.author.id}/subscribe/', 204)
+        flags = user_flags.get(self.user)
+        self.assertEqual(flags.favorites, set())
+        self.assertEqual(flags.shopping_cart, {self.recipes[1].id})
+        self.assertEqual(flags.following, set())
+
+
+class KeysetPaginationTest(APITestCase):
+    """
+    ?cursor= проходит выборку без пропусков и повторов, в том числе по
+    порядку с одинаковыми оценками; валидаторы страницы - без COUNT(*)
+    по всей выборке, фильтр разбирается один раз
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        cls.recipes = []
+        for number in range(13):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipes/image.png')
+            recipe.tags.set([cls.tag])
+            RecipeScore.objects.update_or_create(
+                recipe=recipe, defaults={'popularity': number // 4})
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        clear_caches()
+
+    def walk(self, params):
+        ids, url, pages = [], '/api/recipes/', 0
+        params = {'cursor': '', 'limit': 5, **params}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.json()['results'])
+            url, params = response.json()['next'], None
+            pages += 1
+        self.assertEqual(pages, 3)
+        return ids
+
+    def test_walks_all_recipes(self):
+        self.assertEqual(self.walk({}),
+                         [recipe.id for recipe in reversed(self.recipes)])
+
+    def test_walks_ties_of_multi_field_ordering(self):
+        expected = [recipe.id for recipe in sorted(
+            self.recipes, key=lambda recipe: (
+                -recipe.score.popularity, -recipe.id))]
+        self.assertEqual(self.walk({'ordering': 'popular'}), expected)
+
+    def test_previous_returns_same_page(self):
+        first = self.client.get('/api/recipes/?cursor=&limit=5').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(
+            self.client.get(second['previous']).json()['results'],
+            first['results'])
+
+    def test_foreign_cursor_is_not_found(self):
+        first = self.client.get('/api/recipes/?cursor=&limit=5').json()
+        cursor = parse_qs(urlparse(first['next']).query)['cursor'][0]
+        response = self.client.get('/api/recipes/', {
+            'cursor': cursor, 'ordering': 'popular'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_validators(self):
+        url = '/api/recipes/?cursor=&limit=5&tags=breakfast'
+        with CaptureQueriesContext(connection) as queries:
+            etag = self.client.get(url)['ETag']
+        sql = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse(any('COUNT(' in query for query in sql))
+        self.assertEqual(
+            len([query for query in sql if 'FROM "recipes_tag"' in query
+                 and '"slug" IN' in query]), 1)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # рецепт с другой страницы не меняет ETag первой
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[0].name = 'Новое название'
+            self.recipes[0].save()
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[-1].name = 'Новое название'
+            self.recipes[-1].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['name'],
+                         'Новое название')
+
+
+class ShoppingListTotalTest(APITestCase):
+    """
+    итоги списков покупок совпадают с пересчитанными заново после
+    изменений через API и в обход него (админка, ORM)
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.other = create_user('other')
+        cls.author = create_user('author')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(4)
+        ]
+        cls.recipes = []
+        for number in range(2):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipes/image.png')
+            for ingredient in cls.ingredients[number:number + 3]:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=10)
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        clear_caches()
+
+    def assert_totals(self):
+        computed = {(user, ingredient): total for user, ingredient, total
+                    in ShoppingListTotal.objects.computed()}
+        stored = {(user, ingredient): amount for user, ingredient, amount
+                  in ShoppingListTotal.objects.values_list(
+                      'user', 'ingredient', 'amount')}
+        self.assertEqual(stored, computed)
+
+    def fill_carts(self):
+        for user in (self.user, self.other):
+            for recipe in self.recipes:
+                ShoppingList.objects.add(user, recipe)
+        self.assertTrue(ShoppingListTotal.objects.exists())
+        self.assert_totals()
+
+    def test_api(self):
+        authorize(self.client, self.user)
+        url = f'/api/recipes/{self.recipes[0].id}/shopping_cart/'
+        self.assertEqual(self.client.get(url).status_code, 201)
+        self.assert_totals()
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assert_totals()
+        self.assertFalse(ShoppingListTotal.objects.exists())
+
+    def test_recipe_update_and_delete(self):
+        self.fill_carts()
+        authorize(self.client, self.author)
+        recipe = self.recipes[0]
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/', {'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 25},
+                {'id': self.ingredients[3].id, 'amount': 5},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_totals()
+        self.assertEqual(
+            self.client.delete(f'/api/recipes/{recipe.id}/').status_code, 204)
+        self.assert_totals()
+
+    def test_shopping_list_rows(self):
+        row = ShoppingList.objects.create(user=self.user,
+                                          recipe=self.recipes[0])
+        self.assert_totals()
+        row.recipe = self.recipes[1]
+        row.save()
+        self.assert_totals()
+        row.delete()
+        self.assert_totals()
+        self.fill_carts()
+        ShoppingList.objects.filter(user=self.other).delete()
+        self.assert_totals()
+
+    def test_recipe_ingredient_rows(self):
+        self.fill_carts()
+        row = RecipeIngredient.objects.create(
+            recipe=self.recipes[0], ingredient=self.ingredients[3],
+            amount=7)
+        self.assert_totals()
+        row.amount = 3
+        row.save()
+        self.assert_totals()
+        row.recipe = self.recipes[1]
+        row.ingredient = self.ingredients[0]
+        row.save()
+        self.assert_totals()
+        row.delete()
+        self.assert_totals()
+
+    def test_cascades(self):
+        self.fill_carts()
+        self.recipes[0].delete()
+        self.assert_totals()
+        self.other.delete()
+        self.assert_totals()
+        self.author.delete()
+        self.assert_totals()
+        self.assertFalse(ShoppingListTotal.objects.exists())
+
+
+class LoadDataTest(TestCase):
+    """ строки фикстуры с занятым id или названием не теряются молча """
+
+    def load(self, rows):
+        fixture = [{'model': 'recipes.ingredient', 'pk': pk,
+                    'fields': {'name': name, 'measurement_unit': unit}}
+                   for pk, name, unit in rows]
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.json', encoding='utf-8') as file:
+            json.dump(fixture, file)
+            file.flush()
+            out = StringIO()
+            call_command('load_data', file.name, stdout=out)
+        return out.getvalue()
+
+    def test_conflicts_are_reported(self):
+        output = self.load([(1, 'соль', 'г'), (2, 'соль', 'г'),
+                            (3, 'перец', 'г')])
+        self.assertIn('пропущен id 2 соль (г) - уже есть с id 1', output)
+        output = self.load([(3, 'сахар', 'г'), (1, 'соль', 'г')])
+        self.assertIn('пропущен id 3 сахар (г) - id занят: перец (г)',
+                      output)
+        self.assertIn('пропущено строк фикстуры: 1', output)
+        self.assertEqual(
+            list(Ingredient.objects.order_by('id').values_list(
+                'id', 'name')), [(1, 'соль'), (3, 'перец')])
+
+
+def expected_matches(recipes, ingredient_ids, limit, max_missing=None):
+    """ подбор перебором всех рецептов - эталон для IngredientMatcher """
+    found = []
+    for recipe_id, items in recipes.items():
+        matched = len(items & ingredient_ids)
+        if matched and (max_missing is None
+                        or len(items) - matched <= max_missing):
+            found.append((recipe_id, matched, len(items)))
+    found.sort(key=lambda row: (-row[1] / row[2], row[2] - row[1], -row[0]))
+    return found[:limit]
+
+
+class IngredientMatcherTest(SimpleTestCase):
+    """
+    подбор по индексу совпадает с перебором: и для частых ингредиентов
+    (битовые множества), и для редких (массивы id), и после изменений
+    """
+
+    def make_recipes(self, ids, seed):
+        generator = random.Random(seed)
+        weights = [1 / (number + 1) for number in range(60)]
+        return {
+            recipe_id: set(generator.choices(
+                range(60), weights, k=generator.randint(1, 8)))
+            for recipe_id in ids
+        }
+
+    def make_matcher(self, recipes):
+        matcher = IngredientMatcher()
+        matcher.load((recipe_id, ingredient_id)
+                     for recipe_id, items in sorted(recipes.items())
+                     for ingredient_id in items)
+        return matcher
+
+    def assert_matches(self, matcher, recipes, seed):
+        generator = random.Random(seed)
+        for _ in range(30):
+            ingredient_ids = set(generator.sample(
+                range(70), generator.randint(1, 12)))
+            max_missing = generator.choice([None, 0, 1, 3])
+            self.assertEqual(
+                matcher.match(ingredient_ids, 20, max_missing),
+                expected_matches(recipes, ingredient_ids, 20, max_missing))
+
+    def test_dense_and_sparse_ids(self):
+        for name, ids in (('dense', range(1, 501)),
+                          ('sparse', random.Random(1).sample(
+                              range(1, 200000), 500))):
+            with self.subTest(ids=name):
+                recipes = self.make_recipes(ids, 2)
+                self.assert_matches(self.make_matcher(recipes), recipes, 3)
+
+    def test_replace_and_delete(self):
+        recipes = self.make_recipes(range(1, 301), 4)
+        matcher = self.make_matcher(recipes)
+        generator = random.Random(5)
+        changed = self.make_recipes(generator.sample(range(1, 400), 60), 6)
+        for recipe_id, items in changed.items():
+            matcher._replace(recipe_id, items)
+        recipes.update(changed)
+        for recipe_id in generator.sample(sorted(recipes), 40):
+            matcher._replace(recipe_id, ())
+            del recipes[recipe_id]
+        self.assert_matches(matcher, recipes, 7)
+        self.assertEqual(matcher.stats()['recipes'], len(recipes))
+
+    def test_unknown_ingredients(self):
+        matcher = self.make_matcher(self.make_recipes(range(1, 51), 8))
+        self.assertEqual(matcher.match({1000, 1001}, 20), [])
+
+
+class MatchViewTest(APITestCase):
+    """ /api/recipes/match/ видит изменения рецептов в базе """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(4)
+        ]
+        cls.recipes = []
+        for number, items in enumerate(([0, 1], [0, 1, 2], [2, 3])):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipes/image.png')
+            for item in items:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=cls.ingredients[item],
+                    amount=10)
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        clear_caches()
+        patcher = mock.patch('recipes.views.ingredient_matcher',
+                             IngredientMatcher())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def match(self, *items, **params):
+        ids = ','.join(str(self.ingredients[item].id) for item in items)
+        response = self.client.get('/api/recipes/match/',
+                                   {'ingredients': ids, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(item['name'], item['matched'], item['missing'])
+                for item in response.json()['results']]
+
+    def test_match(self):
+        self.assertEqual(self.match(0, 1), [
+            ('Рецепт 0', 2, 0), ('Рецепт 1', 2, 1)])
+        self.assertEqual(self.match(0, 1, max_missing=0), [
+            ('Рецепт 0', 2, 0)])
+        response = self.client.get('/api/recipes/match/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_follows_changes(self):
+        self.assertEqual(self.match(3), [('Рецепт 2', 1, 1)])
+        RecipeIngredient.objects.create(
+            recipe=self.recipes[0], ingredient=self.ingredients[3],
+            amount=1)
+        self.recipes[0].save()
+        self.recipes[2].delete()
+        self.assertEqual(self.match(3), [('Рецепт 0', 1, 2)])
@@ -1,25 +1,42 @@
-from django.db.models import Sum
-from django.http import FileResponse
-from django.http.response import HttpResponse
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
+from foodgram.db_routers import use_primary
+from .cache import (ingredients_cache, profile_version, response_cache,
+                    tags_cache, touch_user_state, user_flags,
+                    user_state_version)
 from .filters import IngredientFilter, RecipeFilter
-from .mixins import RetriveAndListViewSet
-from .models import (Favorite, Ingredient, Recipe,
-                     ShoppingList, Tag)
-from .paginators import CustomPageNumberPaginator
+from .matching import ingredient_matcher
+from .mixins import (CachedReferenceMixin, ConditionalGetMixin,
+                     RetriveAndListViewSet, SharedResponseCacheMixin)
+from .models import (Favorite, FeedEntry, Ingredient, Recipe, ShoppingList,
+                     ShoppingListTotal, Tag)
+from .paginators import (CursorOrPageNumberPaginator,
+                         CustomPageNumberPaginator, FeedPaginator)
 from .permissions import IsAuthorOrAdmin
-from .serializers import (AddRecipeSerializer, FavouriteSerializer,
-                          IngredientSerializer, ShoppingListSerializer,
-                          ShowRecipeFullSerializer, TagSerializer)
+from .renderers import (ShoppingCartCSVRenderer, ShoppingCartJSONRenderer,
+                        ShoppingCartTextRenderer)
+from .serializers import (AddRecipeSerializer, IngredientSerializer,
+                          MatchedRecipeSerializer, ShowRecipeFullSerializer,
+                          ShowRecipeSerializer, TagSerializer)
+
+NON_FIELD_ERRORS_KEY = api_settings.NON_FIELD_ERRORS_KEY
 
 
-class IngredientViewSet(RetriveAndListViewSet):
+class IngredientViewSet(CachedReferenceMixin, RetriveAndListViewSet):
     """ вьюсет для ингридиентов рецептов """
+    reference_cache = ingredients_cache
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [permissions.AllowAny]
@@ -28,77 +45,293 @@ class IngredientViewSet(RetriveAndListViewSet):
     filterset_class = IngredientFilter
 
 
-class TagsViewSet(RetriveAndListViewSet):
+class TagsViewSet(CachedReferenceMixin, RetriveAndListViewSet):
     """ вьюсет для тегов """
+    reference_cache = tags_cache
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [permissions.AllowAny]
     pagination_class = None
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    """ вьюсет для рецептов + методы для избранного и списка покупок """
+class RecipeViewSet(ConditionalGetMixin, SharedResponseCacheMixin,
+                    viewsets.ModelViewSet):
+    """
+    вьюсет для рецептов + методы для избранного и списка покупок,
+    список и рецепт отдают ETag/Last-Modified и 304 без сериализации,
+    готовые ответы - из общего кэша с флагами пользователя;
+    trending и ?ordering=popular - по оценкам из RecipeScore,
+    feed - лента рецептов авторов из подписок, match - подбор рецептов
+    по имеющимся ингредиентам
+    """
     queryset = Recipe.objects.all().order_by('-id')
     serializer_class = ShowRecipeFullSerializer
     permission_classes = [IsAuthorOrAdmin]
     filter_backends = [DjangoFilterBackend]
-    pagination_class = CustomPageNumberPaginator
+    pagination_class = CursorOrPageNumberPaginator
     filterset_class = RecipeFilter
+    response_cache_params = ('page', 'limit', 'cursor', 'count', 'tags',
+                             'author', 'is_favorited', 'is_in_shopping_cart',
+                             'search', 'ordering')
+    list_actions = ('list', 'trending', 'feed', 'match')
+    private_response_params = ('is_favorited', 'is_in_shopping_cart')
+
+    def get_queryset(self):
+        if self.action not in (*self.list_actions, 'retrieve'):
+            return super().get_queryset()
+        return Recipe.objects.for_display().with_user_flags(
+            self.request.user).order_by('-id')
+
+    def response_items(self, data):
+        if self.action in self.list_actions:
+            return data['results']
+        return [data]
+
+    def get_response_dependencies(self, data):
+        """ рецепты и авторы в ответе, для списка - его фильтр """
+        names = {'tags', 'ingredients'}
+        if self.action in self.list_actions:
+            params = self.request.query_params
+            if self.action == 'trending' or params.get('ordering'):
+                names.add('scores')
+            if params.get('search'):
+                names.add('search')
+            tags = params.getlist('tags')
+            names.update(f'tag:{slug}' for slug in tags)
+            if params.get('author'):
+                names.add(f'author-recipes:{params["author"]}')
+            if not tags and not params.get('author'):
+                names.add('recipes')
+        for item in self.response_items(data):
+            names.add(f'recipe:{item["id"]}')
+            names.add(f'author:{item["author"]["id"]}')
+        return names
+
+    def personalize_response(self, data, user):
+        flags = user_flags.get(user)
+        for item in self.response_items(data):
+            item['is_favorited'] = item['id'] in flags.favorites
+            item['is_in_shopping_cart'] = item['id'] in flags.shopping_cart
+            item['author']['is_subscribed'] = (
+                item['author']['id'] in flags.following)
+        return data
+
+    def anonymize_response(self, data):
+        for item in self.response_items(data):
+            item['is_favorited'] = False
+            item['is_in_shopping_cart'] = False
+            item['author']['is_subscribed'] = False
+        return data
+
+    def validators(self, *parts, updated_at=None, author='any'):
+        """
+        etag из состояния выборки, пользователя, профилей авторов и
+        справочников; last_modified - последнее изменение рецептов,
+        флагов пользователя или профиля автора (author, 'any' - любого)
+        """
+        user = self.request.user
+        user_state = user_state_version(user)
+        profile_state = profile_version(author)
+        parts += (user.id, user_state, profile_state, tags_cache.version(),
+                  ingredients_cache.version())
+        etag = '"{}"'.format(hashlib.sha1(
+            repr(parts).encode()).hexdigest())
+        last_modified = max(
+            updated_at.timestamp() if updated_at else 0, user_state,
+            profile_state)
+        return etag, int(last_modified)
+
+    def filter_queryset(self, queryset):
+        """
+        список фильтруется один раз: list_validators и list берут одну
+        выборку, форма фильтра (и теги по slug) не разбирается дважды
+        """
+        if self.action != 'list':
+            return super().filter_queryset(queryset)
+        if getattr(self, 'filtered_queryset', None) is None:
+            self.filtered_queryset = super().filter_queryset(queryset)
+        return self.filtered_queryset
+
+    def list_validators(self):
+        """
+        постранично - число и последнее изменение всей выборки, по
+        курсору - только строки самой страницы и наличие соседних
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        params = self.request.query_params
+        query = sorted(params.lists())
+        if params.get('ordering'):
+            query.append(response_cache.generations(['scores']))
+        cursor_paginator_class = self.pagination_class.cursor_paginator_class
+        if cursor_paginator_class.cursor_query_param not in params:
+            state = queryset.values('pk').aggregate(
+                count=Count('id'), updated_at=Max('updated_at'))
+            return self.validators(query, state['count'],
+                                   state['updated_at'],
+                                   updated_at=state['updated_at'])
+        paginator = cursor_paginator_class()
+        page = paginator.paginate_queryset(
+            queryset.select_related(None).prefetch_related(None).only(
+                'id', 'updated_at'), self.request, self) or []
+        rows = [(recipe.id, recipe.updated_at) for recipe in page]
+        return self.validators(
+            query, rows, paginator.count, paginator.has_next,
+            paginator.has_previous,
+            updated_at=max((updated_at for _, updated_at in rows),
+                           default=None))
+
+    def retrieve_validators(self):
+        try:
+            state = Recipe.objects.filter(pk=self.kwargs['pk']).values_list(
+                'updated_at', 'author').first()
+        except ValueError:
+            # нечисловой id - 404 из retrieve
+            return None
+        if state is None:
+            return None
+        updated_at, author = state
+        return self.validators(self.kwargs['pk'], updated_at,
+                               updated_at=updated_at, author=author)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in self.list_actions:
+            context['image_rendition'] = 'image_card'
+        return context
 
     def get_serializer_class(self):
+        if self.action == 'match':
+            return MatchedRecipeSerializer
         if self.request.method == 'GET':
             return ShowRecipeFullSerializer
         return AddRecipeSerializer
 
-    @action(detail=True, permission_classes=[IsAuthorOrAdmin])
-    def favorite(self, request, pk):
-        data = {'user': request.user.id, 'recipe': pk}
-        serializer = FavouriteSerializer(data=data,
-                                         context={'request': request})
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+    def add_user_recipe(self, model, error, pk):
+        """ добавление в избранное/список покупок одной вставкой """
+        use_primary()
+        recipe = get_object_or_404(Recipe.objects.only(
+            'id', 'name', 'image', 'image_card', 'cooking_time'), pk=pk)
+        with transaction.atomic():
+            if not model.objects.add(self.request.user, recipe):
+                raise ValidationError({NON_FIELD_ERRORS_KEY: [error]})
+            user_flags.invalidate(self.request.user)
+        touch_user_state(self.request.user)
+        serializer = ShowRecipeSerializer(
+            recipe, context={'request': self.request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def remove_user_recipe(self, model, pk):
+        """ удаление из избранного/списка покупок одним DELETE """
+        with transaction.atomic():
+            if not model.objects.remove(self.request.user, pk):
+                raise Http404
+            user_flags.invalidate(self.request.user)
+        touch_user_state(self.request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, permission_classes=[permissions.IsAuthenticated])
+    def favorite(self, request, pk):
+        return self.add_user_recipe(Favorite, 'Уже в избранном', pk)
+
     @favorite.mapping.delete
     def delete_favorite(self, request, pk):
-        user = request.user
-        recipe = get_object_or_404(Recipe, id=pk)
-        favorite = get_object_or_404(Favorite, user=user, recipe=recipe)
-        favorite.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.remove_user_recipe(Favorite, pk)
 
-    @action(detail=True, permission_classes=[IsAuthorOrAdmin])
+    @action(detail=True, permission_classes=[permissions.IsAuthenticated])
     def shopping_cart(self, request, pk):
-        data = {'user': request.user.id, 'recipe': pk}
-        serializer = ShoppingListSerializer(data=data,
-                                            context={'request': request})
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return self.add_user_recipe(ShoppingList, 'уже в списке', pk)
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
-        user = request.user
-        recipe = get_object_or_404(Recipe, id=pk)
-        shopping_list = get_object_or_404(ShoppingList,
-                                          user=user, recipe=recipe)
-        shopping_list.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.remove_user_recipe(ShoppingList, pk)
+
+    @action(detail=False)
+    def trending(self, request):
+        """ лента по оценке trending, с теми же фильтрами, что и список """
+        return self.cached_or_render('trending', self.trending_list, request)
+
+    def trending_list(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).ranked(
+            'trending')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        permission_classes=[permissions.IsAuthenticated],
+        pagination_class=FeedPaginator,
+    )
+    def feed(self, request):
+        """ рецепты авторов из подписок, новые сверху, по курсору """
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def get_page_ids(self, position, reverse, limit):
+        return FeedEntry.objects.recipe_ids(
+            self.request.user, position, reverse, limit)
+
+    @action(detail=False, pagination_class=CustomPageNumberPaginator)
+    def match(self, request):
+        """
+        рецепты, для которых есть ингредиенты ?ingredients=1,2,3: сначала
+        с большей долей имеющихся, ?max_missing= - не больше стольких
+        недостающих; не больше MATCH_LIMIT лучших
+        """
+        ingredient_ids, max_missing = self.get_match_params()
+        ingredient_matcher.refresh()
+        found = ingredient_matcher.match(
+            ingredient_ids, settings.MATCH_LIMIT, max_missing)
+        page = self.paginate_queryset(found)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        results = []
+        for recipe_id, matched, total in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.matched, recipe.missing = matched, total - matched
+            results.append(recipe)
+        serializer = self.get_serializer(results, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def get_match_params(self):
+        params = self.request.query_params
+        try:
+            ingredient_ids = {
+                int(value)
+                for param in params.getlist('ingredients')
+                for value in param.split(',') if value.strip()
+            }
+            max_missing = params.get('max_missing') or None
+            if max_missing is not None:
+                max_missing = int(max_missing)
+        except ValueError:
+            raise ValidationError({NON_FIELD_ERRORS_KEY: [
+                'ingredients и max_missing - целые числа']})
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': ['Укажите id имеющихся ингредиентов']})
+        return ingredient_ids, max_missing
 
-    @action(detail=False, permission_classes=[permissions.IsAuthenticated])
+    @action(
+        detail=False,
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=[ShoppingCartTextRenderer, ShoppingCartCSVRenderer,
+                          ShoppingCartJSONRenderer],
+    )
     def download_shopping_cart(self, request):
-        print('download_shopping_cart')
-        name = 'recipe__ingredients__name'
-        unit = 'recipe__ingredients__measurement_unit'
-        amount = 'recipe__ingredients__ingredients__amount'
-        user = request.user
-        shopping_list = ShoppingList.objects.filter(
-            user=user
-            ).order_by(name).values(name, unit).annotate(amount=Sum(amount))
-        text = 'Список покупок:\n\n'
-        for number, item in enumerate(shopping_list, start=1):
-            text += f'{number}) {item[name]} - {item["amount"]} {item[unit]}\n'
-        shop_list_file = open("purchase.txt", "w+")
-        shop_list_file.write(text)
-        response = FileResponse(text)
+        shopping_list = ShoppingListTotal.objects.filter(
+            user=request.user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ).order_by('ingredient__name')
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(shopping_list.iterator(chunk_size=500)),
+            content_type=renderer.content_type,
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{renderer.filename}"')
         return response
@@ -14,6 +14,8 @@ class UserAdmin(admin.ModelAdmin):
         'first_name',
         'last_name',
         'is_staff',
+        'recipes_count',
+        'followers_count',
     )
     search_fields = ('username', 'email')
 
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:16
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def counted(model, field):
+    """ COUNT(*) строк model, ссылающихся полем field на текущую строку """
+    return Coalesce(models.Subquery(
+        model.objects.filter(**{field: models.OuterRef('pk')}).order_by()
+        .values(field).annotate(total=models.Count('pk')).values('total')
+    ), 0)
+
+
+def fill_followers(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+    User.objects.update(followers_count=counted(Follow, 'following'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_follow_auto_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов'),
+        ),
+        migrations.RunPython(fill_followers, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Greatest
 
 
 class User(AbstractUser):
@@ -24,6 +25,16 @@ class User(AbstractUser):
         unique=True,
         verbose_name='e-mail',
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков',
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -33,9 +44,44 @@ class User(AbstractUser):
         return self.username
 
 
+class FollowQuerySet(models.QuerySet):
+    """ подписки; followers_count автора меняется в той же транзакции """
+
+    def subscribe(self, user, following):
+        """
+        подписка одним INSERT ... ON CONFLICT DO NOTHING без гонок
+        между воркерами; True - подписка создана, False - уже была
+        """
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, following_id) '
+                'VALUES (%s, %s) ON CONFLICT DO NOTHING RETURNING id',
+                [user.id, following.id],
+            )
+            if cursor.fetchone() is None:
+                return False
+            self.change_followers(following.id, 1)
+        return True
+
+    def unsubscribe(self, user, following_id):
+        """ один DELETE; True - подписка была удалена """
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            deleted, _ = self.filter(
+                user=user, following_id=following_id).delete()
+            if deleted:
+                self.change_followers(following_id, -1)
+        return bool(deleted)
+
+    def change_followers(self, user_id, delta):
+        User.objects.filter(pk=user_id).update(followers_count=Greatest(
+            models.F('followers_count') + delta, 0))
+
+
 class Follow(models.Model):
     """ Модель для подписок на авторов """
-    id = models.PositiveIntegerField(primary_key=True)
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -49,6 +95,8 @@ class Follow(models.Model):
         verbose_name='Подписки'
     )
 
+    objects = FollowQuerySet.as_manager()
+
     class Meta:
         constraints = [models.UniqueConstraint(
             fields=['user', 'following'],
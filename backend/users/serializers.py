@@ -2,6 +2,7 @@ from django.contrib.auth import get_user_model
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
 
+from recipes.fields import RecipeImageField
 from recipes.models import Recipe
 from .models import Follow
 
@@ -25,6 +26,8 @@ class CustomUserSerializer(UserSerializer):
                   'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -32,32 +35,10 @@ class CustomUserSerializer(UserSerializer):
                                      following=obj).exists()
 
 
-class FollowSerializer(serializers.ModelSerializer):
-    """ сериалайзер подписок +валидатор """
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
-    following = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all())
-
-    class Meta:
-        model = Follow
-        fields = ('user', 'following')
-
-    def validate(self, data):
-        user = data['user']
-        if Follow.objects.filter(
-            user=user,
-            following=data['following']
-            ).exists():
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого пользователя')
-        if user.id == data['following'].id:
-            raise serializers.ValidationError('Нельзя подписаться на себя')
-        else:
-            return data
-
-
 class FollowingRecipesSerializers(serializers.ModelSerializer):
     """ сериалайзер рецептов в подписках """
+    image = RecipeImageField('image_card')
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
@@ -67,7 +48,6 @@ class ShowFollowSerializer(serializers.ModelSerializer):
     """ сериалайзер просмотра подписок """
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -76,21 +56,24 @@ class ShowFollowSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return obj.follower.filter(user=obj, following=request.user).exists()
+        return Follow.objects.filter(user=request.user,
+                                     following=obj).exists()
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit is not None:
-            recipes = obj.recipes.all()[:(int(recipes_limit))]
+        if hasattr(obj, 'recipe_previews'):
+            recipes = obj.recipe_previews
         else:
-            recipes = obj.recipes.all()
+            recipes_limit = request.query_params.get('recipes_limit')
+            if recipes_limit is not None:
+                recipes = obj.recipes.all()[:(int(recipes_limit))]
+            else:
+                recipes = obj.recipes.all()
         context = {'request': request}
         return FollowingRecipesSerializers(recipes, many=True,
                                            context=context).data
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
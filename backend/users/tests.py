@@ -0,0 +1,162 @@
+import random
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection, router
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from foodgram.db_routers import ReplicaRoutingMiddleware
+from .models import Follow, User
+
+
+def create_users(prefix, count):
+    User.objects.bulk_create(
+        User(username=f'{prefix}{number}',
+             email=f'{prefix}{number}@example.com',
+             first_name='Имя', last_name='Фамилия')
+        for number in range(count))
+
+
+class ParallelSubscribeTest(TransactionTestCase):
+    """
+    сотни одновременных подписок из разных потоков (и соединений), каждая
+    пара подписчик/автор - дважды: без ошибок, по одной строке и одному
+    подписчику на пару; время подписки не растет вместе с таблицей.
+    Нужна база с ожиданием блокировок: manage.py test
+    --settings=foodgram.settings_test (для sqlite - файлом)
+    """
+    workers = 16
+    subscribers = 20
+    authors = 10
+    rounds = 3
+    filler = 5000
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('sqlite в памяти не ждет блокировок')
+        create_users('filler', 100)
+        self.filler_users = list(
+            User.objects.filter(username__startswith='filler'))
+
+    def subscribe(self, pair):
+        user, author = pair
+        started = time.perf_counter()
+        try:
+            created = Follow.objects.subscribe(user, author)
+        except Exception as error:
+            return pair, error, None
+        finally:
+            connection.close()
+        return pair, created, time.perf_counter() - started
+
+    def subscribe_round(self, number):
+        """ медиана времени подписки в раунде """
+        create_users(f'subscriber{number}-', self.subscribers)
+        create_users(f'author{number}-', self.authors)
+        users = User.objects.filter(
+            username__startswith=f'subscriber{number}-')
+        authors = list(
+            User.objects.filter(username__startswith=f'author{number}-'))
+        pairs = [(user, author) for user in users for author in authors]
+        calls = pairs * 2
+        random.shuffle(calls)
+        with ThreadPoolExecutor(self.workers) as executor:
+            results = list(executor.map(self.subscribe, calls))
+        errors = [result for _, result, duration in results
+                  if duration is None]
+        self.assertEqual(errors, [])
+        created = Counter(pair for pair, result, _ in results if result)
+        self.assertEqual(set(created), set(pairs))
+        self.assertEqual(set(created.values()), {1})
+        self.assertEqual(Follow.objects.filter(
+            following__in=authors).count(), len(pairs))
+        self.assertEqual(
+            set(User.objects.filter(pk__in=[author.pk for author in authors])
+                .values_list('followers_count', flat=True)),
+            {self.subscribers})
+        return statistics.median(duration for _, _, duration in results)
+
+    def grow_table(self, number):
+        """ еще filler подписок, не связанных с раундами """
+        pairs = [(user, author) for user in self.filler_users
+                 for author in self.filler_users if user != author]
+        Follow.objects.bulk_create(
+            Follow(user=user, following=author) for user, author in
+            pairs[number * self.filler:(number + 1) * self.filler])
+
+    def test_parallel_subscribe(self):
+        medians = []
+        for number in range(self.rounds):
+            medians.append(self.subscribe_round(number))
+            self.grow_table(number)
+        # запас на шум планировщика: рост таблицы в разы не должен давать
+        # такого же роста времени подписки
+        self.assertLess(medians[-1], medians[0] * 3 + 0.01, medians)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTest(TransactionTestCase):
+    """
+    безопасные запросы читают с реплики, запись и чтение клиента сразу
+    после его записи или входа - с основной БД
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass',
+            first_name='Имя', last_name='Фамилия')
+
+    def read_alias(self, method='get', token=None, view=None):
+        """ база, с которой прочитала бы вьюха запроса """
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        request = getattr(RequestFactory(), method)('/api/recipes/',
+                                                    **headers)
+        aliases = []
+
+        def get_response(request):
+            if view is not None:
+                view(request)
+            aliases.append(router.db_for_read(User))
+            return HttpResponse()
+
+        ReplicaRoutingMiddleware(get_response)(request)
+        return aliases[0]
+
+    def test_safe_requests_read_replica(self):
+        self.assertEqual(self.read_alias(), 'replica1')
+        self.assertEqual(self.read_alias(token='abc'), 'replica1')
+        self.assertEqual(self.read_alias('post'), DEFAULT_DB_ALIAS)
+
+    def test_client_reads_primary_after_own_write(self):
+        def write(request):
+            User.objects.filter(pk=self.user.pk).update(first_name='Новое')
+
+        self.read_alias('post', token='abc', view=write)
+        self.assertEqual(self.read_alias(token='abc'), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.read_alias(token='other'), 'replica1')
+        cache.clear()
+        self.assertEqual(self.read_alias(token='abc'), 'replica1')
+
+    def test_login_pins_new_token(self):
+        token = Token.objects.create(user=self.user)
+
+        def login(request):
+            user_logged_in.send(sender=User, request=request, user=self.user)
+
+        self.read_alias('post', view=login)
+        self.assertEqual(self.read_alias(token=token.key), DEFAULT_DB_ALIAS)
+
+    def test_login_without_token(self):
+        def login(request):
+            user_logged_in.send(sender=User, request=request, user=self.user)
+
+        # вход в админку по сессии: токена нет, закреплять нечего
+        self.read_alias('post', view=login)
+        self.assertEqual(self.read_alias(token='abc'), 'replica1')
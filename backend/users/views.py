@@ -1,17 +1,25 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
+from foodgram.db_routers import use_primary
 from .models import Follow
-from recipes.paginators import CustomPageNumberPaginator
+from recipes.cache import touch_user_state, user_flags
+from recipes.models import FeedEntry, Recipe
+from recipes.paginators import CursorOrPageNumberPaginator
 from .serializers import (
-    FollowSerializer,
     ShowFollowSerializer,
     CustomUserSerializer)
 
 User = get_user_model()
+NON_FIELD_ERRORS_KEY = api_settings.NON_FIELD_ERRORS_KEY
 
 
 class FollowApiView(APIView):
@@ -19,34 +27,65 @@ class FollowApiView(APIView):
     permission_classes = [permissions.IsAuthenticated, ]
 
     def get(self, request, id):
+        use_primary()
         user = request.user
-        data = {'user': request.user.id, 'following': id}
-        serializer = FollowSerializer(
-            data=data,
-            context={'request': request})
-        serializer.is_valid(raise_exception=True)
         following = get_object_or_404(User, id=id)
-        f_count = Follow.objects.count() + 1
-        serializer.save(user=user, following=following, id=f_count)
+        if user.id == following.id:
+            raise ValidationError(
+                {NON_FIELD_ERRORS_KEY: ['Нельзя подписаться на себя']})
+        with transaction.atomic():
+            if not Follow.objects.subscribe(user, following):
+                raise ValidationError({NON_FIELD_ERRORS_KEY: [
+                    'Вы уже подписаны на этого пользователя']})
+            FeedEntry.objects.follow(user, following)
+        user_flags.invalidate(user)
+        touch_user_state(user)
+        following.is_subscribed = True
         follower = CustomUserSerializer(following)
         return Response(follower.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, id):
         user = request.user
-        following = get_object_or_404(User, id=id)
-        subscription = get_object_or_404(Follow, user=user,
-                                         following=following)
-        subscription.delete()
+        with transaction.atomic():
+            if not Follow.objects.unsubscribe(user, id):
+                raise Http404
+            FeedEntry.objects.unfollow(user, id)
+        user_flags.invalidate(user)
+        touch_user_state(user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class ListFollowViewSet(generics.ListAPIView):
-    """ класс для списка подписок """
+    """
+    класс для списка подписок: число рецептов считается в той же выборке,
+    превью рецептов всех авторов страницы загружаются одним запросом
+    """
     queryset = User.objects.all()
     permission_classes = [permissions.IsAuthenticated, ]
     serializer_class = ShowFollowSerializer
-    pagination_class = CustomPageNumberPaginator
+    pagination_class = CursorOrPageNumberPaginator
 
     def get_queryset(self):
         user = self.request.user
-        return User.objects.filter(following__user=user)
+        return User.objects.filter(following__user=user).annotate(
+            is_subscribed=Exists(Follow.objects.filter(
+                user=user, following=OuterRef('pk'))),
+        )
+
+    def get_recipes_limit(self):
+        try:
+            limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return limit if limit >= 0 else None
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        authors = {author.id: author for author in page or ()}
+        for author in authors.values():
+            author.recipe_previews = []
+        previews = Recipe.objects.previews(
+            list(authors), self.get_recipes_limit())
+        for recipe in previews:
+            authors[recipe.author_id].recipe_previews.append(recipe)
+        return page